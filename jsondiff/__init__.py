@@ -1,8 +1,15 @@
+import bisect
+import codecs
+import heapq
 import json
-import yaml
+import re
+import time
+
+from collections import OrderedDict
 
 from json import JSONDecodeError
-from yaml import YAMLError
+from json.decoder import scanstring
+from types import GeneratorType
 
 from .symbols import *
 from .symbols import Symbol
@@ -14,22 +21,99 @@ from ._version import __version__
 # - when source is list and diff is a list patch dict -> patch
 # - else -> replacement
 
+def _orjson_backend():
+    import orjson
+
+    def dumps(obj, indent=None, sort_keys=False):
+        if indent not in (None, 2):
+            raise ValueError(f"orjson only indents by 2 spaces, not {indent}")
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode()
+
+    return orjson.loads, dumps
+
+
+def _ujson_backend():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+def _simdjson_backend():
+    import simdjson
+    return simdjson.loads, json.dumps
+
+
+def _json_backend():
+    return json.loads, json.dumps
+
+
+# Functions importing a json backend and returning its (loads, dumps), where loads accepts str and bytes
+# and dumps returns str. The auto backend picks the first one installed.
+json_backends = OrderedDict([
+    ("orjson", _orjson_backend),
+    ("ujson", _ujson_backend),
+    ("simdjson", _simdjson_backend),
+    ("json", _json_backend),
+])
+
+
+def _import_json_backend(backend):
+    """
+    :param backend: Name of a json backend, or "auto" for the first installed one.
+    :return: The name of the backend and its (loads, dumps).
+    :raise ValueError: The backend is unknown.
+    :raise ImportError: The backend is not installed.
+    """
+    if backend == "auto":
+        for name, import_backend in json_backends.items():
+            try:
+                return name, import_backend()
+            except ImportError:
+                pass
+    if backend not in json_backends:
+        raise ValueError(f"Unsupported json backend {backend}, expected one of {list(json_backends)} or auto")
+    return backend, json_backends[backend]()
+
+
 class JsonDumper:
-    def __init__(self, **kwargs):
+    """
+    Write object as a JSON string.
+
+    :param backend: Name of the json backend in json_backends, or "auto" for the fastest one installed, which
+        uses the stdlib json module when given kwargs other than None. Backends differ in their whitespace,
+        and orjson only indents by 2 spaces.
+    :param kwargs: Keyword arguments of json.dumps, passed to the backend.
+    """
+
+    def __init__(self, backend="json", **kwargs):
         self.kwargs = kwargs
+        if backend == "auto" and any(v is not None for v in kwargs.values()):
+            backend = "json"
+        self.backend, (_, self.dumps) = _import_json_backend(backend)
+        # Fails early on kwargs the backend does not support
+        self.dumps(None, **kwargs)
 
     def __call__(self, obj, dest=None):
+        if self.backend == "json":
+            if dest is None:
+                return json.dumps(obj, **self.kwargs)
+            else:
+                return json.dump(obj, dest, **self.kwargs)
+        s = self.dumps(obj, **self.kwargs)
         if dest is None:
-            return json.dumps(obj, **self.kwargs)
-        else:
-            return json.dump(obj, dest, **self.kwargs)
+            return s
+        dest.write(s)
 
 
 default_dumper = JsonDumper()
 
 
 class YamlDumper:
-    """Write object as YAML string"""
+    """Write object as YAML string, with the libyaml emitter when PyYAML was built with it"""
 
     def __init__(self, **kwargs):
         self.kwargs = kwargs
@@ -40,68 +124,131 @@ class YamlDumper:
         :param dest: file-like object
         :return: str
         """
-        return yaml.dump(obj, dest, **self.kwargs)
+        import yaml
+        return yaml.dump(obj, dest, Dumper=getattr(yaml, "CDumper", yaml.Dumper), **self.kwargs)
+
+# Runs of digits long enough to be integers beyond 64 bits, which orjson parses as floats
+_long_digits = re.compile(r"\d{19}")
+_long_digits_bytes = re.compile(rb"\d{19}")
+
 
 class JsonLoader:
-    def __init__(self, **kwargs):
+    """
+    Load JSON data from file-like object or string.
+
+    :param backend: Name of the json backend in json_backends, or "auto" for the fastest one installed. The
+        auto backend uses the stdlib json module when given kwargs, and falls back to it for documents the
+        backend rejects, such as NaN, and for those with integers which may not fit in 64 bits, so it loads
+        the same values. Other backends may parse such integers as floats.
+    :param kwargs: Keyword arguments of json.loads, passed to the backend.
+    """
+
+    def __init__(self, backend="json", **kwargs):
         self.kwargs = kwargs
+        self.fallback = backend == "auto"
+        if self.fallback:
+            # Picked on first use, so that importing jsondiff does not import the backend
+            self.backend = "json" if kwargs else None
+        else:
+            self.backend, (self.loads, _) = _import_json_backend(backend)
 
     def __call__(self, src):
         """Parse and return JSON data
-        :param src: str|file-like source
+        :param src: str|bytes|file-like source, files opened in binary mode are not decoded by the backend
         :return: dict parsed data
         """
-        if isinstance(src, str):
+        if not isinstance(src, (str, bytes, bytearray)):
+            src = src.read()
+        if self.backend is None:
+            self.backend, (self.loads, _) = _import_json_backend("auto")
+        if self.backend == "json":
             return json.loads(src, **self.kwargs)
-        else:
-            return json.load(src, **self.kwargs)
+        if self.fallback and (_long_digits if isinstance(src, str) else _long_digits_bytes).search(src):
+            return json.loads(src)
+        try:
+            return self.loads(src, **self.kwargs)
+        except ValueError:
+            if not self.fallback:
+                raise
+        return json.loads(src)
 
 
 default_loader = JsonLoader()
 
 
 class YamlLoader:
-    """Load YAML data from file-like object or string"""
+    """Load YAML data from file-like object or string, with the libyaml parser when PyYAML was built with it"""
 
     def __call__(self, src):
         """Parse and return YAML data
         :param src: str|file-like source
         :return: dict parsed data
         """
-        return yaml.safe_load(src)
+        import yaml
+        return yaml.load(src, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+    def load_all(self, src):
+        """Parse the documents of a YAML stream one at a time
+        :param src: str|file-like source
+        :return: iterator of the parsed documents
+        """
+        import yaml
+        return yaml.load_all(src, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
 class Serializer:
     """Serializer helper loads and stores object data
     :param file_format: str json or yaml
     :param indent: int Output indentation in spaces
+    :param json_backend: str Name of the json backend, see JsonLoader. By default json is loaded and dumped
+        with the stdlib json module.
     :raise ValueError: file_path does not contains valid file_format data
     """
 
-    def __init__(self, file_format, indent):
+    def __init__(self, file_format, indent, json_backend=None):
         # pyyaml _can_ load json but is ~20 times slower and has known issues so use
-        # the json from stdlib when json is specified.
+        # a json backend when json is specified.
         self.serializers = {
-            "json": (JsonLoader(), JsonDumper(indent=indent)),
+            "json": (JsonLoader(json_backend or "json"), JsonDumper(json_backend or "json", indent=indent)),
             "yaml": (YamlLoader(), YamlDumper(indent=indent)),
         }
         self.file_format = file_format
         if file_format not in self.serializers:
             raise ValueError(f"Unsupported serialization format {file_format}, expected one of {self.serializers.keys()}")
+        # yaml is only imported when used, as it makes up most of the import time of jsondiff
+        self.errors = (ValueError,)
+        if file_format == "yaml":
+            from yaml import YAMLError
+            self.errors += (YAMLError,)
 
     def deserialize_file(self, src):
         """Deserialize file from the specified format
         :param file_path: str path to file
-        :param src: str|file-like source
+        :param src: str|bytes|file-like source, possibly opened in binary mode
         :return dict
         :raise ValueError: file_path does not contain valid file_format data
         """
         loader, _ = self.serializers[self.file_format]
         try:
             parsed = loader(src)
-        except (JSONDecodeError, YAMLError) as ex:
+        except self.errors as ex:
             raise ValueError(f"Invalid {self.file_format} file") from ex
         return parsed
 
+    def deserialize_documents(self, src):
+        """Deserialize the documents of a file one at a time, yaml files may contain several
+        :param src: str|file-like source
+        :return iterator of the parsed documents
+        :raise ValueError: src does not contain valid file_format data, raised while iterating
+        """
+        loader, _ = self.serializers[self.file_format]
+        try:
+            if hasattr(loader, "load_all"):
+                yield from loader.load_all(src)
+            else:
+                yield loader(src)
+        except self.errors as ex:
+            raise ValueError(f"Invalid {self.file_format} file") from ex
+
     def serialize_data(self, obj, stream):
         """Serialize obj and write to stream
         :param obj: dict to serialize
@@ -111,6 +258,154 @@ class Serializer:
         dumper(obj, stream)
 
 
+def _edit_list(a, deletes, inserts):
+    """
+    Deletes the positions in deletes from a list, then inserts the (pos, value) pairs of inserts, as the
+    same sequence of list.pop and list.insert calls would, without modifying a. Diffs list their deletions
+    in descending and their insertions in ascending order, in which case the result is built in a single
+    pass over a rather than shifting its elements for every edit.
+
+    :return: The edited list.
+    """
+    n = len(a)
+    inserts = list(inserts)
+    if not (
+        all(p > q for p, q in zip(deletes, deletes[1:]))
+        and all(p[0] < q[0] for p, q in zip(inserts, inserts[1:]))
+        and (not deletes or 0 <= deletes[-1] and deletes[0] < n)
+        and (not inserts or 0 <= inserts[0][0] and inserts[-1][0] - len(inserts) < n - len(deletes))
+    ):
+        r = list(a)
+        for pos in deletes:
+            r.pop(pos)
+        for pos, value in inserts:
+            r.insert(pos, value)
+        return r
+    kept = []
+    start = 0
+    for pos in reversed(deletes):
+        kept += a[start:pos]
+        start = pos + 1
+    kept += a[start:]
+    if not inserts:
+        return kept
+    r = []
+    start = 0
+    for k, (pos, value) in enumerate(inserts):
+        r += kept[start:pos-k]
+        r.append(value)
+        start = pos - k
+    r += kept[start:]
+    return r
+
+
+def _patch_tree(a, d, patch_node, inplace, depth=0):
+    """
+    Applies a diff by recursion up to _max_frames levels and on an explicit stack past them, so that the depth
+    of the structure is not bounded by the recursion limit. Nested diffs are applied depth first, in the order
+    of their keys.
+
+    :param patch_node: Function (a, d, inplace, nested) applying d to a but for the diffs of the children of
+        a, which it appends to nested as (container, key, diff) triples to apply to container[key]. It returns
+        the patched value along with a function finishing it once its children are patched, or None.
+    :return: The patched structure.
+    """
+    if depth < _max_frames:
+        nested = []
+        a, finish = patch_node(a, d, inplace, nested)
+        for container, key, d in nested:
+            container[key] = _patch_tree(container[key], d, patch_node, inplace, depth + 1)
+        return a if finish is None else finish(a)
+    root = [a]
+    stack = [(root, 0, d, None)]
+    nested = []
+    while stack:
+        container, key, d, finish = stack.pop()
+        if finish is not None:
+            container[key] = finish(container[key])
+            continue
+        container[key], finish = patch_node(container[key], d, inplace, nested)
+        if finish is not None:
+            stack.append((container, key, None, finish))
+        if nested:
+            stack.extend((c, k, v, None) for c, k, v in reversed(nested))
+            nested.clear()
+    return root[0]
+
+
+def _compose_list(syntax, d1, d2, with_values):
+    """
+    Composes two list diffs by replaying them on placeholders of the original elements: (i, None) for
+    the untouched i-th element, (i, diff) for the i-th element patched with diff, and (None, value) for
+    inserted values. Elements past the last position the diffs refer to are not affected by them.
+
+    :param with_values: Whether deletions are (pos, value) pairs rather than positions.
+    :return: The composed diff.
+    """
+    edits = []
+    positions = []
+    for d in (d1, d2):
+        deletes = d.get(delete, [])
+        if with_values:
+            values = [value for pos, value in deletes]
+            deletes = [pos for pos, value in deletes]
+        else:
+            values = [None] * len(deletes)
+        inserts = [(pos, (None, value)) for pos, value in d.get(insert, [])]
+        changes = [(int(k), v) for k, v in d.items() if k is not delete and k is not insert]
+        edits.append((deletes, values, inserts, changes))
+        positions += deletes
+        positions += [pos for pos, value in inserts]
+        positions += [k for k, v in changes]
+    n = max(positions, default=-1) + 1 + sum(len(deletes) for deletes, _, _, _ in edits)
+
+    tokens = [(i, None) for i in range(n)]
+    removed = {}
+    for deletes, values, inserts, changes in edits:
+        if all(p > q for p, q in zip(deletes, deletes[1:])):
+            dropped = [tokens[pos] for pos in deletes]
+        else:
+            r = list(tokens)
+            dropped = [r.pop(pos) for pos in deletes]
+        for (i, x), value in zip(dropped, values):
+            if i is not None:
+                removed[i] = value if x is None or not with_values else syntax.unpatch(value, x)
+        tokens = _edit_list(tokens, deletes, inserts)
+        for k, v in changes:
+            i, x = tokens[k]
+            if i is None:
+                tokens[k] = (None, syntax.patch(x, v))
+            else:
+                tokens[k] = (i, v if x is None else syntax.compose(x, v))
+
+    inserted = []
+    changed = {}
+    for j, (i, x) in enumerate(tokens):
+        if i is None:
+            inserted.append((j, x))
+        elif x is not None and x != {}:
+            changed[j] = x
+    deleted = sorted(removed.items(), reverse=True)
+    # Only part of the list is known, so neither a replacement nor an empty diff is emitted
+    return syntax.emit_list_diff(None, None, 0.5, inserted, changed, deleted)
+
+
+def _compose_sets(d1, d2):
+    """
+    Composes the additions and discards of two set diffs.
+    """
+    added1, discarded1 = set(d1.get(add, ())), set(d1.get(discard, ()))
+    added2, discarded2 = set(d2.get(add, ())), set(d2.get(discard, ()))
+    d = {}
+    discarded = (discarded1 - added2) | (discarded2 - added1)
+    added = (added1 - discarded2) | (added2 - discarded1)
+    if discarded:
+        d[discard] = discarded
+    if added:
+        d[add] = added
+    return d
+
+
 class JsonDiffSyntax:
     def emit_set_diff(self, a, b, s, added, removed):
         """
@@ -164,23 +459,36 @@ class JsonDiffSyntax:
         """
         raise NotImplementedError()
 
-    def patch(self, a, d):
+    def patch(self, a, d, inplace=False):
         """
         Applies a patch to a JSON structure.
 
         :param a: The original JSON structure.
         :param d: The patch to apply.
+        :param inplace: Whether to mutate the dicts, lists and sets of a instead of copying them.
         :return: The patched JSON structure.
         :raises NotImplementedError: This is an abstract method.
         """
         raise NotImplementedError()
 
-    def unpatch(self, a, d):
+    def compose(self, d1, d2):
+        """
+        Composes two consecutive diffs into one.
+
+        :param d1: The first diff.
+        :param d2: The diff applied after d1.
+        :return: A diff patching like d1 then d2.
+        :raises NotImplementedError: This is an abstract method.
+        """
+        raise NotImplementedError()
+
+    def unpatch(self, a, d, inplace=False):
         """
         Reverses a patch on a JSON structure.
 
         :param a: The patched JSON structure.
         :param d: The patch that was applied.
+        :param inplace: Whether to mutate the dicts, lists and sets of a instead of copying them.
         :return: The original JSON structure before the patch was applied.
         :raises NotImplementedError: This is an abstract method.
         """
@@ -290,59 +598,130 @@ class CompactJsonDiffSyntax:
         else:
             return {replace: b} if isinstance(b, dict) else b
 
-    def patch(self, a, d):
+    def patch(self, a, d, inplace=False):
         """
         Applies a compact diff to a JSON structure to produce the modified structure.
 
         :param a: The original JSON structure.
         :param d: The compact diff to apply.
+        :param inplace: Whether to mutate the dicts, lists and sets of a instead of copying them.
         :return: The modified JSON structure after applying the diff.
         """
+        return _patch_tree(a, d, self._patch_node, inplace)
+
+    def _patch_node(self, a, d, inplace, nested):
+        """
+        Applies a compact diff to a value but for the diffs of its children, see _patch_tree.
+        """
         if isinstance(d, dict):
             if not d:
-                return a
+                return a, None
             if replace in d:
-                return d[replace]
+                return d[replace], None
             if isinstance(a, dict):
-                a = dict(a)
+                if not inplace:
+                    a = dict(a)
                 for k, v in d.items():
                     if k is delete:
                         for kdel in v:
                             del a[kdel]
+                    elif isinstance(v, dict) and (k in a or replace in v or delete in v):
+                        if k not in a:
+                            # A value added along with edits of it, which compose marks, see compose
+                            a[k] = {}
+                        nested.append((a, k, v))
                     else:
-                        av = a.get(k, missing)
-                        if av is missing:
-                            a[k] = v
-                        else:
-                            a[k] = self.patch(av, v)
-                return a
+                        # Values other than dicts replace the value they patch
+                        a[k] = v
+                return a, None
             elif isinstance(a, (list, tuple)):
                 original_type = type(a)
-                a = list(a)
-                if delete in d:
-                    for pos in d[delete]:
-                        a.pop(pos)
-                if insert in d:
-                    for pos, value in d[insert]:
-                        a.insert(pos, value)
+                if delete in d or insert in d:
+                    r = _edit_list(a, d.get(delete, []), d.get(insert, []))
+                    if inplace and original_type is list:
+                        a[:] = r
+                    else:
+                        a = r
+                elif not inplace or original_type is not list:
+                    a = list(a)
                 for k, v in d.items():
                     if k is not delete and k is not insert:
-                        k = int(k)
-                        a[k] = self.patch(a[k], v)
-                if original_type is not list:
-                    a = original_type(a)
-                return a
+                        if isinstance(v, dict):
+                            nested.append((a, int(k), v))
+                        else:
+                            a[int(k)] = v
+                return a, None if original_type is list else original_type
             elif isinstance(a, set):
-                a = set(a)
+                if not inplace:
+                    a = set(a)
                 if discard in d:
                     for x in d[discard]:
                         a.discard(x)
                 if add in d:
                     for x in d[add]:
                         a.add(x)
-                return a
+                return a, None
+        return d, None
+
+
+    def compose(self, d1, d2):
+        """
+        Composes two consecutive compact diffs into one, without the document they apply to.
+
+        A compact diff does not tell a key added to a dict from a changed one, so the composed diff applies
+        either way. Dict values set by d1 are composed with d2 as patches of the existing values, and dicts
+        holding such edits are marked with deletions, possibly none, so that patch builds them from an empty
+        dict when their key is missing. Keys which d1 sets and d2 deletes keep a value set right before the
+        deletion. Likewise, a diff deleting integer positions is taken as a list diff rather than as the diff
+        of a dict with integer keys.
+
+        :param d1: The first compact diff.
+        :param d2: The compact diff applied after d1.
+        :return: A compact diff patching like d1 then d2.
+        """
+        if not isinstance(d2, dict) or replace in d2:
+            return d2
+        if not d2:
+            return d1
+        if not isinstance(d1, dict) or replace in d1:
+            value = d1[replace] if isinstance(d1, dict) else d1
+            return self.emit_value_diff(None, self.patch(value, d2), 0.0)
+        if not d1:
+            return d2
+        if add in d1 or discard in d1 or add in d2 or discard in d2:
+            return _compose_sets(d1, d2)
+        if self._is_list_diff(d1) or self._is_list_diff(d2):
+            return _compose_list(self, d1, d2, False)
+        d = {k: v for k, v in d1.items() if k is not delete}
+        deleted = dict.fromkeys(d1.get(delete, []))
+        edited = False
+        for k, v in d2.items():
+            if k is delete:
+                for kdel in v:
+                    # The key may have been added rather than changed, so it keeps a value set right away for
+                    # the deletion to apply either way, as the entries of a diff apply in order. Dicts, which
+                    # would only be patched after the deletion, are set aside for None.
+                    if isinstance(d.get(kdel), dict):
+                        d[kdel] = None
+                    deleted[kdel] = None
+            elif k in deleted:
+                # Deleted by d1, so the original value is replaced
+                del deleted[k]
+                d[k] = self.emit_value_diff(None, self.patch({}, v) if isinstance(v, dict) else v, 0.0)
+            elif k in d:
+                d[k] = self.compose(d[k], v)
+                if isinstance(d[k], dict) and (delete in d[k] or replace in d[k]):
+                    edited = True
+            else:
+                d[k] = v
+        if deleted or edited:
+            d[delete] = list(deleted)
         return d
 
+    @staticmethod
+    def _is_list_diff(d):
+        return insert in d or (bool(d.get(delete)) and all(isinstance(pos, int) for pos in d[delete]))
+
 
 class ExplicitJsonDiffSyntax:
     """
@@ -563,22 +942,30 @@ class SymmetricJsonDiffSyntax:
         else:
             return [a, b]
 
-    def patch(self, a, d):
+    def patch(self, a, d, inplace=False):
         """
         Applies a symmetric diff to a JSON structure to produce the modified structure.
 
         :param a: The original JSON structure.
         :param d: The symmetric diff to apply.
+        :param inplace: Whether to mutate the dicts, lists and sets of a instead of copying them.
         :return: The modified JSON structure after applying the diff.
         """
+        return _patch_tree(a, d, self._patch_node, inplace)
+
+    def _patch_node(self, a, d, inplace, nested):
+        """
+        Applies a symmetric diff to a value but for the diffs of its children, see _patch_tree.
+        """
         if isinstance(d, list):
             _, b = d
-            return b
+            return b, None
         elif isinstance(d, dict):
             if not d:
-                return a
+                return a, None
             if isinstance(a, dict):
-                a = dict(a)
+                if not inplace:
+                    a = dict(a)
                 for k, v in d.items():
                     if k is delete:
                         for kdel, _ in v.items():
@@ -586,52 +973,66 @@ class SymmetricJsonDiffSyntax:
                     elif k is insert:
                         for kk, vv in v.items():
                             a[kk] = vv
+                    elif isinstance(v, list):
+                        # A value replaced by another one, as [old, new]
+                        _, a[k] = v
                     else:
-                        a[k] = self.patch(a[k], v)
-                return a
+                        nested.append((a, k, v))
+                return a, None
             elif isinstance(a, (list, tuple)):
                 original_type = type(a)
-                a = list(a)
-                if delete in d:
-                    for pos, value in d[delete]:
-                        a.pop(pos)
-                if insert in d:
-                    for pos, value in d[insert]:
-                        a.insert(pos, value)
+                if delete in d or insert in d:
+                    r = _edit_list(a, [pos for pos, value in d.get(delete, [])], d.get(insert, []))
+                    if inplace and original_type is list:
+                        a[:] = r
+                    else:
+                        a = r
+                elif not inplace or original_type is not list:
+                    a = list(a)
                 for k, v in d.items():
                     if k is not delete and k is not insert:
-                        k = int(k)
-                        a[k] = self.patch(a[k], v)
-                if original_type is not list:
-                    a = original_type(a)
-                return a
+                        if isinstance(v, list):
+                            _, a[int(k)] = v
+                        else:
+                            nested.append((a, int(k), v))
+                return a, None if original_type is list else original_type
             elif isinstance(a, set):
-                a = set(a)
+                if not inplace:
+                    a = set(a)
                 if discard in d:
                     for x in d[discard]:
                         a.discard(x)
                 if add in d:
                     for x in d[add]:
                         a.add(x)
-                return a
+                return a, None
         raise Exception("Invalid symmetric diff")
 
-    def unpatch(self, b, d):
+    def unpatch(self, b, d, inplace=False):
         """
         Reverses a symmetric diff on a JSON structure to produce the original structure.
 
         :param b: The modified JSON structure.
         :param d: The symmetric diff that was applied.
+        :param inplace: Whether to mutate the dicts, lists and sets of b instead of copying them.
         :return: The original JSON structure before the diff was applied.
         """
+        return _patch_tree(b, d, self._unpatch_node, inplace)
+
+    def _unpatch_node(self, b, d, inplace, nested):
+        """
+        Reverses a symmetric diff on a value but for the diffs of its children, see _patch_tree. Lists are
+        edited once their elements are unpatched.
+        """
         if isinstance(d, list):
             a, _ = d
-            return a
+            return a, None
         elif isinstance(d, dict):
             if not d:
-                return b
+                return b, None
             if isinstance(b, dict):
-                b = dict(b)
+                if not inplace:
+                    b = dict(b)
                 for k, v in d.items():
                     if k is delete:
                         for kk, vv in v.items():
@@ -639,37 +1040,95 @@ class SymmetricJsonDiffSyntax:
                     elif k is insert:
                         for kk, vv in v.items():
                             del b[kk]
+                    elif isinstance(v, list):
+                        b[k], _ = v
                     else:
-                        b[k] = self.unpatch(b[k], v)
-                return b
+                        nested.append((b, k, v))
+                return b, None
             elif isinstance(b, (list, tuple)):
                 original_type = type(b)
-                b = list(b)
+                if not inplace or original_type is not list:
+                    b = list(b)
                 for k, v in d.items():
                     if k is not delete and k is not insert:
-                        k = int(k)
-                        b[k] = self.unpatch(b[k], v)
-                if insert in d:
-                    for pos, value in reversed(d[insert]):
-                        b.pop(pos)
-                if delete in d:
-                    for pos, value in reversed(d[delete]):
-                        b.insert(pos, value)
-                if original_type is not list:
-                    b = original_type(b)
-                return b
+                        if isinstance(v, list):
+                            b[int(k)], _ = v
+                        else:
+                            nested.append((b, int(k), v))
+
+                def finish(b):
+                    if delete in d or insert in d:
+                        r = _edit_list(b, [pos for pos, value in reversed(d.get(insert, []))],
+                                       reversed(d.get(delete, [])))
+                        if inplace and original_type is list:
+                            b[:] = r
+                        else:
+                            b = r
+                    return b if original_type is list else original_type(b)
+
+                return b, finish
             elif isinstance(b, set):
-                b = set(b)
+                if not inplace:
+                    b = set(b)
                 if discard in d:
                     for x in d[discard]:
                         b.add(x)
                 if add in d:
                     for x in d[add]:
                         b.discard(x)
-                return b
+                return b, None
         raise Exception("Invalid symmetric diff")
 
 
+    def compose(self, d1, d2):
+        """
+        Composes two consecutive symmetric diffs into one, without the document they apply to. Symmetric
+        diffs hold the values they delete and replace, so the composed diff can be unpatched as well.
+
+        :param d1: The first symmetric diff.
+        :param d2: The symmetric diff applied after d1.
+        :return: A symmetric diff patching like d1 then d2.
+        """
+        if isinstance(d2, list):
+            a = d1[0] if isinstance(d1, list) else self.unpatch(d2[0], d1)
+            return [a, d2[1]]
+        if not d2:
+            return d1
+        if isinstance(d1, list):
+            return [d1[0], self.patch(d1[1], d2)]
+        if not d1:
+            return d2
+        if add in d1 or discard in d1 or add in d2 or discard in d2:
+            return _compose_sets(d1, d2)
+        if any(isinstance(d.get(k), list) for d in (d1, d2) for k in (insert, delete)):
+            return _compose_list(self, d1, d2, True)
+        inserted = dict(d1.get(insert, {}))
+        deleted = dict(d1.get(delete, {}))
+        changed = {k: v for k, v in d1.items() if k is not insert and k is not delete}
+        for k, v in d2.get(insert, {}).items():
+            if k in deleted:
+                changed[k] = self.emit_value_diff(deleted.pop(k), v, 0.0)
+            else:
+                inserted[k] = v
+        for k, v in d2.get(delete, {}).items():
+            if k in inserted:
+                del inserted[k]
+            elif k in changed:
+                deleted[k] = self.unpatch(v, changed.pop(k))
+            else:
+                deleted[k] = v
+        for k, v in d2.items():
+            if k is insert or k is delete:
+                continue
+            if k in inserted:
+                inserted[k] = self.patch(inserted[k], v)
+            elif k in changed:
+                changed[k] = self.compose(changed[k], v)
+            else:
+                changed[k] = v
+        return self.emit_dict_diff(None, None, 0.5, inserted, changed, deleted)
+
+
 class RightOnlyJsonDiffSyntax(CompactJsonDiffSyntax):
     """
     Extends CompactJsonDiffSyntax to focus exclusively on the right (modified) values for lists,
@@ -738,6 +1197,578 @@ class RightOnlyJsonDiffSyntax(CompactJsonDiffSyntax):
             return b
 
 
+# Emitters which only use the edits of partially differing dicts and lists, not the values themselves, so
+# that diff_stream emits them without holding the values in memory. Others are passed the values read whole.
+_edit_emitters = frozenset((
+    CompactJsonDiffSyntax.emit_dict_diff, CompactJsonDiffSyntax.emit_list_diff,
+    ExplicitJsonDiffSyntax.emit_dict_diff, ExplicitJsonDiffSyntax.emit_list_diff,
+    SymmetricJsonDiffSyntax.emit_dict_diff, SymmetricJsonDiffSyntax.emit_list_diff,
+    RightOnlyJsonDiffSyntax.emit_dict_diff,
+))
+
+_containers = (dict, list, tuple, set)
+# Score of values which differ, yet whose score rounds to 1.0, as when they only differ dozens of levels deep
+_almost_one = 1.0 - 2.0 ** -53
+# Types of the values that marshal and unmarshal return as they are, without a call per value
+_plain_types = frozenset((int, float, bool, type(None)))
+
+
+def _map_tree(o, f, done=(), depth=0):
+    """
+    Copies the dicts, lists and tuples of a structure with f applied to their keys and to their other values,
+    by recursion for the first levels and on an explicit stack past them, so that any depth is supported. Values
+    of plain types are kept as they are, and so are the values whose ids are in done.
+
+    :param depth: The Python frames taken by the recursion, two per level with the comprehension, see _max_frames.
+    """
+    if depth < _max_frames:
+        if id(o) in done:
+            return o
+        depth += 2
+        if isinstance(o, dict):
+            return {
+                f(k): v if type(v) in _plain_types or id(v) in done else
+                f(v) if type(v) is str else _map_tree(v, f, done, depth)
+                for k, v in o.items()
+            }
+        elif isinstance(o, (list, tuple)):
+            r = [
+                x if type(x) in _plain_types or id(x) in done else
+                f(x) if type(x) is str else _map_tree(x, f, done, depth)
+                for x in o
+            ]
+            return r if isinstance(o, list) else type(o)(r)
+        else:
+            return f(o)
+    root = [o]
+    stack = [(root, 0, o, None)]
+    while stack:
+        container, key, o, finish = stack.pop()
+        if finish is not None:
+            container[key] = finish(container[key])
+        elif id(o) in done:
+            continue
+        elif isinstance(o, dict):
+            r = container[key] = {}
+            nested = []
+            for k, v in o.items():
+                k = f(k)
+                if type(v) in _plain_types or id(v) in done:
+                    r[k] = v
+                elif type(v) is str:
+                    r[k] = f(v)
+                else:
+                    r[k] = v
+                    nested.append((r, k, v, None))
+            # Popped in order, as the values of a dict display are evaluated
+            stack.extend(reversed(nested))
+        elif isinstance(o, (list, tuple)):
+            r = container[key] = list(o)
+            if not isinstance(o, list):
+                # Rebuilt once the elements are mapped
+                stack.append((container, key, None, type(o)))
+            for i, x in enumerate(o):
+                if type(x) in _plain_types or id(x) in done:
+                    continue
+                elif type(x) is str:
+                    r[i] = f(x)
+                else:
+                    stack.append((r, i, x, None))
+        else:
+            container[key] = f(o)
+    return root[0]
+
+
+class _PathTrie:
+    """
+    exclude_paths and list_keys compiled into a trie of dot-separated path segments. A `*` segment matches
+    any dict key or list index.
+    """
+    __slots__ = ('children', 'excluded', 'list_key')
+
+    def __init__(self):
+        self.children = {}
+        self.excluded = False
+        self.list_key = None
+
+    @classmethod
+    def compile(cls, paths, list_keys=None):
+        root = cls()
+        for path in paths:
+            root._node(path).excluded = True
+        if list_keys:
+            for path, key in list_keys.items():
+                root._node(path).list_key = key
+        return root
+
+    def _node(self, path):
+        node = self
+        if path != '':
+            for segment in str(path).split('.'):
+                node = node.children.setdefault(segment, type(self)())
+        return node
+
+
+class _OverBudget(Exception):
+    """
+    Raised when aligning two lists would exceed the max_lcs_cells or timeout budget of JsonDiffer.
+    """
+
+
+# Python frames taken by the recursion over nested dicts and lists, past which the diff engine switches to
+# frames run on an explicit stack, see JsonDiffer._diff_step, and the patch and marshal walks to a loop. Each level of
+# nesting takes three of them, or up to eight when lists are aligned, well within the recursion limit.
+_max_frames = 384
+
+
+# Levels of nesting past which values are diffed in the calling process rather than sent to worker processes,
+# as pickle recurses over them
+_max_pickled_nesting = 192
+
+
+def _nested_deeper(o, depth):
+    """
+    Tells whether o nests dicts, lists, tuples or sets more than depth levels deep, with an explicit stack.
+    """
+    stack = [(o, 0)]
+    while stack:
+        o, level = stack.pop()
+        if isinstance(o, dict):
+            values = o.values()
+        elif isinstance(o, (list, tuple, set)):
+            values = o
+        else:
+            continue
+        if level == depth:
+            return True
+        stack.extend((v, level + 1) for v in values if isinstance(v, _containers))
+    return False
+
+
+def _deep_equal(a, b):
+    """
+    Compares two structures like == with an explicit stack, descending into dicts, lists and tuples.
+    """
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if a is b:
+            continue
+        if isinstance(a, dict) and isinstance(b, dict):
+            if len(a) != len(b):
+                return False
+            for k, v in a.items():
+                w = b.get(k, missing)
+                if w is missing:
+                    return False
+                stack.append((v, w))
+        elif (isinstance(a, list) and isinstance(b, list)) or (isinstance(a, tuple) and isinstance(b, tuple)):
+            if len(a) != len(b):
+                return False
+            stack.extend(zip(a, b))
+        elif a != b:
+            return False
+    return True
+
+
+def _scalar_hash(o):
+    """
+    Hash of a scalar for structural hashing, or None if it is unhashable. Strings are salted since
+    they never equal numbers, yet the empty string hashes like 0 and False.
+    """
+    try:
+        h = hash(o)
+    except TypeError:
+        return None
+    return h ^ 0x5bd1e995 if isinstance(o, str) else h
+
+
+def _structural_hash(o, hashes):
+    """
+    Returns the structural hash of o, which is equal for equal values, or None if o holds
+    unhashable values. Differing values may still share a hash, such as (-1,) and (-2,). Hashes of containers are computed bottom-up and cached in hashes by object id,
+    as (container, hash) pairs.
+    """
+    if not isinstance(o, _containers):
+        return _scalar_hash(o)
+    cached = hashes.get(id(o))
+    if cached is not None:
+        return cached[1]
+    stack = [(o, False)]
+    while stack:
+        x, expanded = stack.pop()
+        if id(x) in hashes:
+            continue
+        if not expanded:
+            # Containers of hashable values are hashed natively, which is much faster than walking them
+            try:
+                if isinstance(x, dict):
+                    h = hash(('d', frozenset(x.items())))
+                elif isinstance(x, set):
+                    h = hash(('s', frozenset(x)))
+                else:
+                    h = hash(('t' if isinstance(x, tuple) else 'l', tuple(x)))
+            except TypeError:
+                if isinstance(x, set):
+                    hashes[id(x)] = (x, None)
+                    continue
+            else:
+                hashes[id(x)] = (x, h)
+                continue
+            stack.append((x, True))
+            stack.extend(
+                (c, False)
+                for c in (x.values() if isinstance(x, dict) else x)
+                if isinstance(c, _containers) and id(c) not in hashes
+            )
+            continue
+        children = x.values() if isinstance(x, dict) else x
+        hs = []
+        for c in children:
+            h = hashes[id(c)][1] if isinstance(c, _containers) else _scalar_hash(c)
+            if h is None:
+                break
+            hs.append(h)
+        else:
+            if isinstance(x, dict):
+                h = hash(('d', frozenset(zip(x.keys(), hs))))
+            else:
+                h = hash(('t' if isinstance(x, tuple) else 'l', tuple(hs)))
+        # The object is stored along with its hash so that its id cannot be reused while it is cached
+        hashes[id(x)] = (x, h)
+    return hashes[id(o)][1]
+
+
+class DocumentIndex:
+    """
+    A JSON structure along with the structural hashes of its containers, which JsonDiffer.diff, diff_many,
+    similarity and most_similar accept in place of the structure. The hashes are computed once, as with the
+    hashing option, so that every diff or similarity involving the structure recognizes its equal subtrees
+    by value and tells differing ones apart in O(1), without walking it to hash it again. As with the hashing
+    option, this pays off when the structures compared share most of their subtrees.
+
+    The structure must not be modified once indexed. Hashes of strings differ between interpreters, so the
+    index pickles as the structure alone, and hashes it again the first time it is used after unpickling.
+    """
+    __slots__ = ('document', '_hashes')
+
+    def __init__(self, document):
+        """
+        :param document: The loaded JSON structure to index.
+        """
+        self.document = document
+        self._hashes = None
+        self._structural_hashes()
+
+    def __getstate__(self):
+        return (self.document,)
+
+    def __setstate__(self, state):
+        self.document, = state
+        self._hashes = None
+
+    def _structural_hashes(self):
+        """
+        :return: The (container, hash) pairs of the containers of the document by id, see _structural_hash.
+        """
+        if self._hashes is None:
+            hashes = {}
+            _structural_hash(self.document, hashes)
+            self._hashes = hashes
+        return self._hashes
+
+
+class _JsonEvents:
+    """
+    Incremental JSON parser reading a file-like object in chunks and turning it into (event, value) pairs:
+    start_map, map_key, end_map, start_array, end_array and value. Only the unread part of the current
+    chunk and the nesting of the current position are held in memory. Documents which json.loads rejects
+    raise JSONDecodeError, once the events up to the error are read.
+    """
+    _space = re.compile(r'[ \t\n\r]*')
+    _string_end = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+    _token_end = re.compile(r'[ \t\n\r,:\]}]')
+
+    def __init__(self, fp, chunk_size=65536):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = None
+        # True for each enclosing object, False for each enclosing array
+        self.stack = []
+        self.key_next = False
+        # What the grammar allows next: a value, or the end of the container just opened as well ('open'),
+        # a ',' or the end of the enclosing container ('comma'), a ':' ('colon'), or nothing ('end')
+        self.state = 'value'
+
+    def _fill(self):
+        """
+        Appends the next chunk of the input to the unread part of the buffer.
+
+        :return: False at the end of the input.
+        """
+        while not self.eof:
+            chunk = self.fp.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+            if isinstance(chunk, bytes):
+                if self.decoder is None:
+                    self.decoder = codecs.getincrementaldecoder('utf-8')()
+                chunk = self.decoder.decode(chunk, final=self.eof)
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def _peek(self):
+        """
+        Skips whitespace and returns the next character.
+        """
+        while True:
+            self.pos = self._space.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise JSONDecodeError('Unexpected end of input', self.buf, self.pos)
+
+    def next(self):
+        """
+        Reads the next event.
+        """
+        c = self._peek()
+        state = self.state
+        if state == 'end':
+            raise JSONDecodeError('Extra data', self.buf, self.pos)
+        closing = ('}' if self.stack[-1] else ']') if self.stack else None
+        if state == 'comma' or state == 'colon':
+            separator = ',' if state == 'comma' else ':'
+            if c == separator:
+                self.pos += 1
+                c = self._peek()
+                state = 'value'
+            elif state == 'colon' or c != closing:
+                raise JSONDecodeError(f"Expecting '{separator}' delimiter", self.buf, self.pos)
+        if c == '}' or c == ']':
+            if c != closing or state == 'value':
+                raise JSONDecodeError('Expecting value', self.buf, self.pos)
+            self.pos += 1
+            self.stack.pop()
+            self.key_next = bool(self.stack) and self.stack[-1]
+            self.state = 'comma' if self.stack else 'end'
+            return ('end_map' if c == '}' else 'end_array'), None
+        if self.key_next and c != '"':
+            raise JSONDecodeError('Expecting property name enclosed in double quotes', self.buf, self.pos)
+        if c == '{' or c == '[':
+            self.pos += 1
+            self.stack.append(c == '{')
+            self.key_next = c == '{'
+            self.state = 'open'
+            return ('start_map' if c == '{' else 'start_array'), None
+        value = self._scalar(c)
+        if self.key_next:
+            self.key_next = False
+            self.state = 'colon'
+            return 'map_key', value
+        self.state = 'comma' if self.stack else 'end'
+        # Keys follow the commas of objects
+        self.key_next = bool(self.stack) and self.stack[-1]
+        return 'value', value
+
+    def end(self):
+        """
+        Checks that only whitespace follows the document.
+        """
+        while True:
+            self.pos = self._space.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                raise JSONDecodeError('Extra data', self.buf, self.pos)
+            if not self._fill():
+                return
+
+    def _scalar(self, c):
+        """
+        Reads the string, number or literal at the current position, once it is whole in the buffer.
+        """
+        while True:
+            if c == '"':
+                m = self._string_end.match(self.buf, self.pos + 1)
+                if m is not None:
+                    value, self.pos = scanstring(self.buf, self.pos + 1)
+                    return value
+            else:
+                m = self._token_end.search(self.buf, self.pos)
+                if m is not None or self.eof:
+                    end = m.start() if m is not None else len(self.buf)
+                    value = json.loads(self.buf[self.pos:end])
+                    self.pos = end
+                    return value
+            if not self._fill() and c == '"':
+                raise JSONDecodeError('Unterminated string', self.buf, self.pos)
+
+    def read_value(self, event):
+        """
+        Reads the whole value starting with the given event.
+        """
+        kind, value = event
+        if kind == 'value':
+            return value
+        elif kind == 'start_map':
+            d = {}
+            kind, key = self.next()
+            while kind != 'end_map':
+                d[key] = self.read_value(self.next())
+                kind, key = self.next()
+            return d
+        elif kind == 'start_array':
+            r = []
+            event = self.next()
+            while event[0] != 'end_array':
+                r.append(self.read_value(event))
+                event = self.next()
+            return r
+        raise JSONDecodeError(f'Unexpected {kind}', self.buf, self.pos)
+
+
+class _DeferredDiff:
+    """
+    Stands for the diff of two values in a node emitted by JsonDiffer._deferred_dict_diff or
+    _deferred_list_diff, until _DiffWriter computes and writes it in its place.
+    """
+    __slots__ = ('a', 'b', 'exclude')
+
+    def __init__(self, a, b, exclude):
+        self.a = a
+        self.b = b
+        self.exclude = exclude
+
+
+class _DiffWriter:
+    """
+    Writes a diff as json like json.dump writes the marshaled diff with the same encoder, but diffs the values
+    of dicts and lists one at a time and writes each diff as soon as it is computed. Only the nodes along the
+    current path are in memory, rather than the whole diff.
+    """
+
+    def __init__(self, differ, encoder, write):
+        self.differ = differ
+        self.encoder = encoder
+        self.write = write
+        indent = encoder.indent
+        self.indent = ' ' * indent if indent is not None and not isinstance(indent, str) else indent
+
+    def diff(self, a, b, exclude, level=0):
+        """
+        Writes the diff of a and b.
+        """
+        differ = self.differ
+        if a is b or (exclude is not None and exclude[0].excluded):
+            node = None
+        elif isinstance(a, dict) and isinstance(b, dict):
+            node, changed = differ._deferred_dict_diff(a, b, exclude)
+        elif (isinstance(a, tuple) and isinstance(b, tuple)) or (isinstance(a, list) and isinstance(b, list)):
+            node, changed = differ._deferred_list_diff(a, b, exclude)
+        else:
+            node = None
+        if node is None:
+            # Diffs of other values are marshaled as they are emitted
+            d, _ = differ._obj_diff(a, b, exclude)
+            self.write(self.encode(d, level))
+        else:
+            self.node(node, changed, level)
+
+    def node(self, node, changed, level):
+        """
+        Writes an emitted node, and the deferred diffs in it and in the dict of changed values it may embed.
+        Its other values are marshaled and encoded in one go.
+        """
+        write = self.write
+        if isinstance(node, dict):
+            items = [(self.differ._escape(k), v) for k, v in node.items()]
+            if self.encoder.sort_keys:
+                items.sort(key=lambda item: item[0])
+            start, end = '{', '}'
+        elif isinstance(node, (list, tuple)):
+            items = [(None, v) for v in node]
+            start, end = '[', ']'
+        else:
+            write(self.encode(self.differ.marshal(node), level))
+            return
+        if not items:
+            write(start + end)
+            return
+
+        write(start)
+        separator = self.encoder.item_separator
+        if self.indent is not None:
+            separator += '\n' + self.indent * (level + 1)
+            write(separator[len(self.encoder.item_separator):])
+        first = True
+        for k, v in items:
+            if k is not None:
+                k = self.key(k)
+                if k is None:
+                    continue
+            if not first:
+                write(separator)
+            first = False
+            if k is not None:
+                write(self.encoder.encode(k) + self.encoder.key_separator)
+            if type(v) is _DeferredDiff:
+                self.diff(v.a, v.b, v.exclude, level + 1)
+            elif v is changed:
+                self.node(v, changed, level + 1)
+            else:
+                write(self.encode(self.differ.marshal(v), level + 1))
+        if self.indent is not None:
+            write('\n' + self.indent * level)
+        write(end)
+
+    def key(self, k):
+        """
+        Converts a dict key to a string like json does, or returns None for keys it skips.
+        """
+        if isinstance(k, str):
+            return k
+        elif k is True:
+            return 'true'
+        elif k is False:
+            return 'false'
+        elif k is None:
+            return 'null'
+        elif isinstance(k, (int, float)):
+            return self.encoder.encode(k)
+        elif self.encoder.skipkeys:
+            return None
+        raise TypeError(f'keys must be str, int, float, bool or None, not {k.__class__.__name__}')
+
+    def encode(self, o, level):
+        """
+        Encodes a marshaled value, indented for the given nesting level.
+        """
+        s = self.encoder.encode(o)
+        if self.indent is not None and level:
+            s = s.replace('\n', '\n' + self.indent * level)
+        return s
+
+
+def _diff_shard(differ, pairs):
+    """
+    Diffs a shard of (a, b, exclude) triples in a worker process.
+    """
+    differ._hashes = {} if differ.options.hashing else None
+    return [differ._obj_diff(a, b, exclude) for a, b, exclude in pairs]
+
+
+def _diff_many_chunk(differ, pairs, exclude_paths, cache_size):
+    """
+    Diffs a chunk of pairs for JsonDiffer.diff_many in a worker process.
+    """
+    return list(differ.diff_many(pairs, exclude_paths, cache_size=cache_size))
+
+
 builtin_syntaxes = {
     'compact': CompactJsonDiffSyntax(),
     'symmetric': SymmetricJsonDiffSyntax(),
@@ -745,6 +1776,9 @@ builtin_syntaxes = {
     'rightonly': RightOnlyJsonDiffSyntax(),
 }
 
+# Syntaxes whose emitters only compare similarity scores to 0.0 and 1.0, see JsonDiffer._deferred_dict_diff
+_deferrable_syntaxes = {type(syntax) for syntax in builtin_syntaxes.values()}
+
 
 class JsonDiffer:
     """
@@ -772,7 +1806,10 @@ class JsonDiffer:
         pass
 
     def __init__(self, syntax='compact', load=False, dump=False, marshal=False,
-                 loader=default_loader, dumper=default_dumper, escape_str='$'):
+                 loader=default_loader, dumper=default_dumper, escape_str='$',
+                 list_cache_size=100000, list_algorithm='lcs', hunk_cells=10000, hashing=False,
+                 set_pairing_limit=None, workers=None, list_keys=None, max_similarity_depth=None,
+                 max_lcs_cells=None, timeout=None, similarity_sample=None):
         """
         Initializes the JsonDiffer with specified options.
 
@@ -783,7 +1820,51 @@ class JsonDiffer:
         :param loader: Custom function for loading JSON data.
         :param dumper: Custom function for dumping JSON data.
         :param escape_str: String used to escape special characters in keys.
-        """
+        :param list_cache_size: Maximum number of pairwise element scores kept per list diff so that
+            backtracking the LCS matrix can reuse them. Oldest entries are evicted first.
+        :param list_algorithm: 'lcs' aligns lists with an LCS weighted by element similarity, which takes
+            O(m*n) time and memory. 'myers' aligns lists on exactly equal elements in linear space and
+            only weighs the similarity of elements within changed hunks.
+        :param hunk_cells: With the 'myers' list algorithm, changed hunks with more cells than this are
+            emitted as deletions and insertions without looking for similar elements.
+        :param hashing: Whether to recognize equal subtrees by value instead of walking them, and to compute
+            structural hashes of the list elements being aligned, so that differing elements are told apart
+            in O(1) and the 'myers' list algorithm matches elements by hash. This pays off when most of the
+            structures are unchanged.
+        :param set_pairing_limit: Maximum number of added set elements each removed element is compared with
+            when pairing them by similarity, picking those which share the most values with it at the same
+            positions, then those closest in length. By default all pairs are
+            compared, which is quadratic. With a limit the similarity score of sets is approximate, while
+            their own diff is unchanged. The approximate score can still change how lists holding sets are
+            aligned.
+        :param workers: Number of processes diffing the values of the top-level dict, or the aligned elements
+            of the top-level list, in parallel. The diff is the same as when diffing serially. Values nested too
+            deep to be pickled to the processes are diffed in this one.
+        :param list_keys: Optional dict mapping the paths of lists of records, in the syntax of exclude_paths,
+            to the key field aligning their elements, as in {'users': 'id', '*.items': 'sku'}. Records with
+            the same key are matched and diffed, in linear time, instead of aligning the lists by similarity.
+            Arrays diffed by diff_stream are still aligned by position.
+        :param max_similarity_depth: Maximum number of nesting levels walked to score the similarity of two
+            values, as when aligning lists. Values deeper than that score 1.0 when equal and 0.0 otherwise.
+        :param max_lcs_cells: With the 'lcs' list algorithm, lists whose alignment takes more cells than this,
+            once their common ends are left out, are emitted as replaced rather than aligned.
+        :param timeout: Number of seconds after which the values still being diffed are emitted as replaced,
+            and similarities are scored as with a max_similarity_depth of 0.
+            Paths of the values replaced because of max_lcs_cells or timeout are reported in degraded_paths
+            after each diff, as tuples of keys and indices in the original structure. These budgets do not
+            apply to diff_stream, and cannot be combined with workers.
+        :param similarity_sample: Number of keys sampled to estimate the similarity score of dictionaries with
+            more keys than this, as when aligning lists, instead of scoring the values of all their keys. Keys
+            are drawn at random with a fixed seed, so that estimates are repeatable. By Hoeffding's inequality,
+            an estimate from n keys is within sqrt(ln(2/δ)/(2n)) of the score computed from the same values
+            with probability 1-δ, that is within 0.043 for 1000 keys at 95%. A value weighs half its score in
+            the score of its dictionary, so estimates nested in one another at most double that bound.
+            Diffs are unchanged, except for how lists are aligned.
+        """
+        if list_algorithm not in ('lcs', 'myers'):
+            raise ValueError(f"Unsupported list algorithm {list_algorithm}, expected one of ('lcs', 'myers')")
+        if workers and workers > 1 and (max_similarity_depth, max_lcs_cells, timeout) != (None, None, None):
+            raise ValueError("Budgets are not supported with workers")
         self.options = JsonDiffer.Options()
         self.options.syntax = builtin_syntaxes.get(syntax, syntax)
         self.options.load = load
@@ -792,91 +1873,614 @@ class JsonDiffer:
         self.options.loader = loader
         self.options.dumper = dumper
         self.options.escape_str = escape_str
+        self.options.list_cache_size = list_cache_size
+        self.options.list_algorithm = list_algorithm
+        self.options.hunk_cells = hunk_cells
+        self.options.hashing = hashing
+        self.options.set_pairing_limit = set_pairing_limit
+        self.options.workers = workers
+        self.options.list_keys = list_keys
+        self.options.max_similarity_depth = max_similarity_depth
+        self.options.max_lcs_cells = max_lcs_cells
+        self.options.timeout = timeout
+        self.options.similarity_sample = similarity_sample
         self._symbol_map = {
             escape_str + symbol.label: symbol
             for symbol in _all_symbols_
         }
+        # The state of the root when no exclude_paths are given, see _path_state
+        self._list_keys = (_PathTrie.compile((), list_keys),) if list_keys else None
+        # Structural hashes by object id, only set while diffing with the hashing option
+        self._hashes = None
+        # Whether diff nodes are marshaled as they are emitted, only set while diffing with marshal or dump
+        self._marshaling = False
+        # Budget state, only set while diffing with budgets: the path of the root, from which the frames
+        # track the keys and indices leading to the values they diff, the monotonic time of the timeout,
+        # and the levels left to score similarities
+        self._path = None
+        self._deadline = None
+        self._depth = None
+        # Python frames taken by the dicts and lists being diffed by recursion, see _max_frames, the similarity
+        # scores of the elements of the lists aligned deeper than that, and those missing from the alignment
+        # being run, see _aligned. The scores are only set while diffing past _max_frames, the missing ones
+        # while aligning.
+        self._frames = 0
+        self._scores = None
+        self._pending = None
+        # Result of the last frame to finish, see _diff_step
+        self._result = None
+        # Paths of the values emitted as replaced by the last diff to exceed a budget
+        self.degraded_paths = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_hashes'] = None
+        state['_scores'] = None
+        state['_result'] = None
+        return state
+
+    def _load(self, o):
+        """
+        Loads o with the loader, unless it is a DocumentIndex, which holds a loaded structure.
+        """
+        return o if isinstance(o, DocumentIndex) else self.options.loader(o)
+
+    def _indexed(self, o):
+        """
+        Unwraps a DocumentIndex, adding the structural hashes of its containers to those of the current diff.
+        """
+        if not isinstance(o, DocumentIndex):
+            return o
+        if self._hashes is None:
+            self._hashes = {}
+        self._hashes.update(o._structural_hashes())
+        return o.document
+
+    def _hash(self, o):
+        """
+        Returns the structural hash of o, see _structural_hash, cached for the duration of a diff.
+        """
+        return _structural_hash(o, self._hashes)
+
+    def _equal(self, a, b):
+        """
+        Tells whether a == b, also for structures nested deeper than the recursion limit lets == compare. Once
+        one is met, containers are compared by structural hash first as with the hashing option, so that deep
+        values are not walked again at every level of the lists they are elements of, and only those with equal
+        hashes are compared on an explicit stack.
+        """
+        hashes = self._hashes
+        if hashes is not None and isinstance(a, _containers):
+            ha = hashes.get(id(a))
+            hb = hashes.get(id(b))
+            # Only containers are cached, and they are kept alive so that no other value can share their id
+            if ha is not None and hb is not None and ha[1] != hb[1] and ha[1] is not None and hb[1] is not None:
+                return False
+        try:
+            return a == b
+        except RecursionError:
+            pass
+        if hashes is None:
+            hashes = self._hashes = {}
+        ha = _structural_hash(a, hashes)
+        hb = _structural_hash(b, hashes)
+        if ha != hb and ha is not None and hb is not None:
+            return False
+        return _deep_equal(a, b)
+
+    def _equal_subtrees(self, a, b):
+        """
+        Tells whether a and b are equal containers. Subtrees whose structural hashes are already known
+        and differ are rejected without comparing their values.
+        """
+        if not isinstance(a, _containers) or not isinstance(b, _containers):
+            return False
+        return self._equal(a, b)
 
-    def _list_diff_0(self, C, X, Y):
+    def _list_diff_0(self, C, X, Y, cache, evicted, rows):
         """
         Helper method for computing list differences using dynamic programming.
+
+        Only the scores of cells where the matrix took the diagonal step are stored in `cache`, so a miss
+        means the cell is not a match unless entries have been `evicted`, in which case the score is
+        computed again.
         """
         i, j = len(X), len(Y)
         r = []
         while True:
             if i > 0 and j > 0:
-                d, s = self._obj_diff(X[i-1], Y[j-1])
-                if s > 0 and C[i][j] == C[i-1][j-1] + s:
-                    r.append((0, d, j-1, s))
+                s = cache.get((i, j))
+                if s is None and evicted:
+                    s = self._obj_similarity(X[i-1], Y[j-1], rows[i-1] if rows else None)
+                if s is not None and s > 0 and C[i][j] == C[i-1][j-1] + s:
+                    r.append((0, i-1, j-1, s))
                     i, j = i - 1, j - 1
                     continue
             if j > 0 and (i == 0 or C[i][j-1] >= C[i-1][j]):
-                r.append((1, Y[j-1], j-1, 0.0))
+                r.append((1, i, j-1, 0.0))
                 j = j - 1
                 continue
             if i > 0 and (j == 0 or C[i][j-1] < C[i-1][j]):
-                r.append((-1, X[i-1], i-1, 0.0))
+                r.append((-1, i-1, j, 0.0))
                 i = i - 1
                 continue
             return reversed(r)
 
-    def _list_diff(self, X, Y):
+    def _list_align(self, X, Y, exclude, rows):
+        """
+        Aligns two lists by the key field the list_keys option gives them, if any, or else by similarity.
+
+        :param exclude: The exclude_paths state of X and Y, see _exclude_child.
+        :param rows: The exclude_paths states of the elements of X, or None.
+        :return: The alignment as (sign, i, j, s) steps, as returned by _list_lcs.
+        """
+        if exclude is not None:
+            for node in exclude:
+                if node.list_key is not None:
+                    return self._list_keyed(X, Y, node.list_key, rows)
+        return self._list_lcs(X, Y, rows)
+
+    def _list_keyed(self, X, Y, key, rows=None):
+        """
+        Aligns two lists of records on the value of their key field, through a hash index of Y, in linear time
+        besides sorting out reordered records.
+
+        Syntaxes have no way to express that an element moved, so records matched in a different order in
+        both lists cannot all stay matched: the longest run of matches in the same order is kept, and the
+        other records are deleted and inserted. So are elements which are not dicts or have no key, or an
+        unhashable one, and records whose key already appeared earlier in their list.
+
+        :param key: The key field of the records.
+        :param rows: Optional exclude_paths states of the elements of X, see _exclude_child.
+        :return: The alignment as (sign, i, j, s) steps, as returned by _list_lcs.
+        """
+        index = {}
+        for j, y in enumerate(Y):
+            k = y.get(key, missing) if isinstance(y, dict) else missing
+            if k is not missing:
+                try:
+                    index.setdefault(k, j)
+                except TypeError:
+                    pass
+        pairs = []
+        for i, x in enumerate(X):
+            k = x.get(key, missing) if isinstance(x, dict) else missing
+            if k is not missing:
+                try:
+                    j = index.pop(k, None)
+                except TypeError:
+                    continue
+                if j is not None:
+                    pairs.append((i, j))
+
+        # Longest increasing run of the positions in Y, in O(p log p), which is all the pairs when the
+        # records are in the same order in both lists
+        tails = []
+        ends = []
+        links = []
+        for p, (i, j) in enumerate(pairs):
+            n = len(tails) if not tails or tails[-1] < j else bisect.bisect_left(tails, j)
+            if n == len(tails):
+                tails.append(j)
+                ends.append(p)
+            else:
+                tails[n] = j
+                ends[n] = p
+            links.append(ends[n-1] if n else None)
+        kept = []
+        p = ends[-1] if ends else None
+        while p is not None:
+            kept.append(pairs[p])
+            p = links[p]
+        kept.reverse()
+
+        r = []
+        i = j = 0
+        for mi, mj in kept:
+            r.extend((-1, k, j, 0.0) for k in range(i, mi))
+            r.extend((1, mi, k, 0.0) for k in range(j, mj))
+            x, y = X[mi], Y[mj]
+            if x is y or self._equal(x, y):
+                s = 1.0
+            else:
+                s = self._obj_similarity(x, y, rows[mi] if rows else None)
+            r.append((0, mi, mj, s))
+            i, j = mi + 1, mj + 1
+        r.extend((-1, k, j, 0.0) for k in range(i, len(X)))
+        r.extend((1, len(X), k, 0.0) for k in range(j, len(Y)))
+        return r
+
+    def _list_lcs(self, X, Y, rows=None):
+        """
+        Aligns two lists using an LCS weighted by the similarity of their elements.
+
+        Leading and trailing elements which are equal in both lists are matched up front, so that
+        only the differing window in the middle goes through the O(m*n) matrix.
+
+        :param rows: Optional exclude_paths states of the elements of X, see _exclude_child.
+        :return: The alignment as (sign, i, j, s) steps in list order, where sign is 0 when X[i] is
+            matched with Y[j] with similarity s, 1 when Y[j] is inserted and -1 when X[i] is deleted.
+        :raises _OverBudget: When the alignment exceeds the max_lcs_cells or timeout budget.
+        """
+        m = len(X)
+        n = len(Y)
+        p = 0
+        while p < m and p < n and (X[p] is Y[p] or self._equal(X[p], Y[p])):
+            p += 1
+        q = 0
+        while q < m - p and q < n - p and (X[m-1-q] is Y[n-1-q] or self._equal(X[m-1-q], Y[n-1-q])):
+            q += 1
+        r = [(0, k, k, 1.0) for k in range(p)]
+        if p == m - q:
+            r.extend((1, p, j, 0.0) for j in range(p, n - q))
+        elif p == n - q:
+            r.extend((-1, i, p, 0.0) for i in range(p, m - q))
+        else:
+            max_cells = self.options.max_lcs_cells
+            if max_cells is not None and self.options.list_algorithm == 'lcs' and (m-q-p) * (n-q-p) > max_cells:
+                raise _OverBudget
+            X, Y = X[p:m-q], Y[p:n-q]
+            if rows is not None:
+                rows = rows[p:m-q]
+            # Elements of the window are compared many times, so their hashes are worth computing
+            keys = None
+            if self._hashes is not None:
+                keys = ([self._hash(x) for x in X], [self._hash(y) for y in Y])
+            if self.options.list_algorithm == 'myers':
+                steps = self._list_myers(X, Y, keys, rows)
+            else:
+                steps = self._list_lcs_0(X, Y, rows)
+            r.extend((sign, i + p, j + p, s) for sign, i, j, s in steps)
+        r.extend((0, m - q + k, n - q + k, 1.0) for k in range(q))
+        return r
+
+    def _list_lcs_0(self, X, Y, rows=None):
         """
-        Computes the difference between two lists.
+        Helper method filling the LCS matrix of two lists and backtracking through it.
         """
-        # LCS
         m = len(X)
         n = len(Y)
         # An (m+1) times (n+1) matrix
         C = [[0 for j in range(n+1)] for i in range(m+1)]
+        # Scores of the cells on which the diagonal step is taken, shared with the backtracking
+        cache = OrderedDict()
+        cache_size = self.options.list_cache_size
+        evicted = False
+        deadline = self._deadline
         for i in range(1, m+1):
+            if deadline is not None and time.monotonic() > deadline:
+                raise _OverBudget
+            row = rows[i-1] if rows else None
             for j in range(1, n+1):
-                _, s = self._obj_diff(X[i-1], Y[j-1])
+                s = self._obj_similarity(X[i-1], Y[j-1], row)
                 # Following lines are part of the original LCS algorithm
                 # left in the code in case modification turns out to be problematic
                 #if X[i-1] == Y[j-1]:
                 #    C[i][j] = C[i-1][j-1] + 1
                 #else:
-                C[i][j] = max(C[i][j-1], C[i-1][j], C[i-1][j-1] + s)
+                diagonal = C[i-1][j-1] + s
+                C[i][j] = max(C[i][j-1], C[i-1][j], diagonal)
+                if s > 0 and C[i][j] == diagonal:
+                    if len(cache) >= cache_size:
+                        evicted = True
+                        if not cache:
+                            continue
+                        cache.popitem(last=False)
+                    cache[i, j] = s
+        return self._list_diff_0(C, X, Y, cache, evicted, rows)
+
+    def _list_myers(self, X, Y, keys=None, rows=None):
+        """
+        Aligns two lists on their exactly equal elements using Myers' O((m+n)*D) difference algorithm
+        in linear space, then aligns the elements of each changed hunk with _list_lcs_0 when the hunk
+        has at most `hunk_cells` cells.
+
+        :param keys: Optional lists of the structural hashes of the elements of X and Y. Elements are
+            then paired with their hashes, so that those whose hashes differ are told apart without
+            comparing their values, while colliding ones are still compared.
+        :return: The alignment in the same form as _list_lcs.
+        """
+        if keys is None:
+            matches = self._myers_matches(X, Y)
+        else:
+            matches = self._myers_matches(list(zip(keys[0], X)), list(zip(keys[1], Y)))
+        r = []
+        hunk_cells = self.options.hunk_cells
+        i = j = 0
+        m = len(X)
+        n = len(Y)
+        for mi, mj in matches + [(m, n)]:
+            if i < mi and j < mj and (mi - i) * (mj - j) <= hunk_cells:
+                r.extend(
+                    (sign, hi + i, hj + j, s)
+                    for sign, hi, hj, s in self._list_lcs_0(X[i:mi], Y[j:mj], rows and rows[i:mi])
+                )
+            else:
+                r.extend((-1, k, j, 0.0) for k in range(i, mi))
+                r.extend((1, mi, k, 0.0) for k in range(j, mj))
+            if mi < m:
+                r.append((0, mi, mj, 1.0))
+            i, j = mi + 1, mj + 1
+        return r
+
+    def _myers_matches(self, X, Y):
+        """
+        Helper method returning the (i, j) index pairs of equal elements on a shortest edit script
+        between two lists, in list order.
+        """
+        matches = []
+        # Ranges are split around the middle of the edit script and processed left to right
+        stack = [(0, len(X), 0, len(Y))]
+        while stack:
+            x0, x1, y0, y1 = stack.pop()
+            while x0 < x1 and y0 < y1 and (X[x0] is Y[y0] or self._equal(X[x0], Y[y0])):
+                matches.append((x0, y0))
+                x0, y0 = x0 + 1, y0 + 1
+            k = 0
+            while x0 < x1 - k and y0 < y1 - k and (X[x1-1-k] is Y[y1-1-k] or self._equal(X[x1-1-k], Y[y1-1-k])):
+                k += 1
+            if k:
+                stack.append((x1 - k, x1, y1 - k, y1))
+                x1, y1 = x1 - k, y1 - k
+            if x0 == x1 or y0 == y1:
+                continue
+            split = self._myers_middle(X, x0, x1, Y, y0, y1)
+            if split is not None:
+                x, y = split
+                stack.append((x, x1, y, y1))
+                stack.append((x0, x, y0, y))
+        return matches
+
+    def _myers_middle(self, X, x0, x1, Y, y0, y1):
+        """
+        Helper method running Myers' search from both ends of X[x0:x1] and Y[y0:y1] until the paths
+        overlap, and returning the split point where they meet, or None if nothing is in common.
+        """
+        n = x1 - x0
+        m = y1 - y0
+        max_d = (n + m + 1) // 2
+        v_offset = max_d
+        v_length = 2 * max_d + 2
+        v1 = [-1] * v_length
+        v1[v_offset + 1] = 0
+        v2 = [-1] * v_length
+        v2[v_offset + 1] = 0
+        delta = n - m
+        # If the total number of elements is odd, the forward path collides with the reverse path
+        front = delta % 2 != 0
+        k1start = k1end = k2start = k2end = 0
+        for d in range(max_d):
+            for k1 in range(-d + k1start, d + 1 - k1end, 2):
+                k1_offset = v_offset + k1
+                if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                    x = v1[k1_offset + 1]
+                else:
+                    x = v1[k1_offset - 1] + 1
+                y = x - k1
+                while x < n and y < m and (X[x0+x] is Y[y0+y] or self._equal(X[x0+x], Y[y0+y])):
+                    x, y = x + 1, y + 1
+                v1[k1_offset] = x
+                if x > n:
+                    k1end += 2
+                elif y > m:
+                    k1start += 2
+                elif front:
+                    k2_offset = v_offset + delta - k1
+                    if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                        if x >= n - v2[k2_offset]:
+                            return x0 + x, y0 + y
+            for k2 in range(-d + k2start, d + 1 - k2end, 2):
+                k2_offset = v_offset + k2
+                if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                    x = v2[k2_offset + 1]
+                else:
+                    x = v2[k2_offset - 1] + 1
+                y = x - k2
+                while x < n and y < m and (X[x1-1-x] is Y[y1-1-y] or self._equal(X[x1-1-x], Y[y1-1-y])):
+                    x, y = x + 1, y + 1
+                v2[k2_offset] = x
+                if x > n:
+                    k2end += 2
+                elif y > m:
+                    k2start += 2
+                elif not front:
+                    k1_offset = v_offset + delta - k2
+                    if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                        x_front = v1[k1_offset]
+                        y_front = v_offset + x_front - k1_offset
+                        if x_front >= n - x:
+                            return x0 + x_front, y0 + y_front
+        return None
+
+    def _list_diff(self, X, Y, exclude, path, pool=None):
+        """
+        Frame computing the difference between two lists, see _diff_step.
+
+        :param path: The keys and indices leading to X and Y while diffing with budgets, or None.
+        :param pool: Optional process pool diffing the aligned elements.
+        """
         inserted = []
         deleted = []
         changed = {}
         tot_s = 0.0
+        rows = None
+        if exclude is not None:
+            rows = [self._exclude_child(exclude, i) for i in range(len(X))]
 
-        for sign, value, pos, s in self._list_diff_0(C, X, Y):
+        try:
+            if self._scores is None:
+                steps = self._list_align(X, Y, exclude, rows)
+            else:
+                steps = yield from self._aligned(X, Y, exclude, rows, self._depth)
+        except _OverBudget:
+            self._result = self._degrade(X, Y, path)
+            return
+        diffs = None
+        if pool is not None:
+            steps = list(steps)
+            diffs = iter(self._sharded_diffs(pool, [
+                (X[i], Y[j], rows[i] if rows else None) for sign, i, j, s in steps if sign == 0 and s < 1
+            ]))
+        for sign, i, j, s in steps:
             if sign == 1:
-                inserted.append((pos, value))
+                inserted.append((j, Y[j]))
             elif sign == -1:
-                deleted.insert(0, (pos, value))
+                deleted.insert(0, (i, X[i]))
             elif sign == 0 and s < 1:
-                changed[pos] = value
+                r = next(diffs) if diffs is not None else None
+                if r is None:
+                    r = self._diff_step(X[i], Y[j], rows[i] if rows else None, None if path is None else path + (i,))
+                    if type(r) is GeneratorType:
+                        yield r
+                        r = self._result
+                changed[j] = r[0]
             tot_s += s
         tot_n = len(X) + len(inserted)
         if tot_n == 0:
             s = 1.0
         else:
             s = tot_s / tot_n
-        return self.options.syntax.emit_list_diff(X, Y, s, inserted, changed, deleted), s
+        if s == 1.0 and (changed or inserted or deleted):
+            s = _almost_one
+        self._result = self._emit(self.options.syntax.emit_list_diff, X, Y, s, inserted, changed, deleted,
+                                  children=changed), s
 
-    def _set_diff(self, a, b):
+    def _list_similarity(self, X, Y, exclude, depth):
         """
-        Computes the difference between two sets.
+        Frame computing the similarity score of two lists, as returned by _list_diff, see _diff_step.
+
+        :param depth: The levels left to score the elements of the lists, or None.
         """
-        removed = a.difference(b)
-        added = b.difference(a)
-        if not removed and not added:
-            return {}, 1.0
-        ranking = sorted(
-            (
-                (self._obj_diff(x, y)[1], x, y)
-                for x in removed
-                for y in added
-            ),
-            reverse=True,
-            key=lambda x: x[0]
-        )
-        r2 = set(removed)
-        a2 = set(added)
+        ninserted = 0
+        tot_s = 0.0
+        rows = None
+        if exclude is not None:
+            rows = [self._exclude_child(exclude, i) for i in range(len(X))]
+        try:
+            if self._scores is None:
+                saved = self._depth
+                self._depth = depth
+                try:
+                    steps = self._list_align(X, Y, exclude, rows)
+                finally:
+                    self._depth = saved
+            else:
+                steps = yield from self._aligned(X, Y, exclude, rows, depth)
+        except _OverBudget:
+            # Scored like the replacement _list_diff emits
+            self._result = 0.0
+            return
+        differs = False
+        for sign, i, j, s in steps:
+            if sign == 1:
+                ninserted += 1
+            if sign != 0 or s < 1.0:
+                differs = True
+            tot_s += s
+        tot_n = len(X) + ninserted
+        s = tot_s / tot_n if tot_n != 0 else 1.0
+        self._result = _almost_one if s == 1.0 and differs else s
+
+    def _aligned(self, X, Y, exclude, rows, depth):
+        """
+        Frame aligning two lists with _list_align once nested values are scored on an explicit stack, see
+        _run_deep. The scores of the dicts, lists and sets it pairs up are looked up rather than computed, see
+        _scored, so the alignment is run once to find out which scores it needs, and again once their frames
+        have computed them.
+
+        :param depth: The levels left to score the elements of the lists, or None.
+        :return: The alignment as (sign, i, j, s) steps, as returned by _list_lcs.
+        """
+        scores = self._scores
+        while True:
+            pending = {}
+            saved = self._pending, self._depth
+            self._pending, self._depth = pending, depth
+            try:
+                steps = self._list_align(X, Y, exclude, rows)
+            finally:
+                self._pending, self._depth = saved
+            # Backtracking may ask for scores the first run did not, after evicting some from its cache
+            if not pending:
+                return steps
+            for key, (x, y, row) in pending.items():
+                s = self._similarity_step(x, y, row, depth)
+                if type(s) is GeneratorType:
+                    yield s
+                    s = self._result
+                scores[key] = s
+
+    def _scored(self, a, b, exclude):
+        """
+        Returns the similarity score of two elements of the lists _aligned is aligning, or 0 when it is not
+        computed yet, in which case it is recorded as missing.
+        """
+        # Elements are parts of the structures being diffed, so their ids are not reused while the scores are kept
+        key = (id(a), id(b), exclude, self._depth)
+        s = self._scores.get(key)
+        if s is None:
+            self._pending[key] = (a, b, exclude)
+            return 0.0
+        return s
+
+    def _set_similarity_0(self, a, removed, added):
+        """
+        Helper method pairing the removed and added elements of a set by similarity.
+
+        Differing elements only score above 0 when both are tuples, so other elements are left out of
+        the pairing. With the `set_pairing_limit` option, each removed tuple is only scored against that
+        many added tuples, preferring those which share values at the same positions.
+        """
+        removed_tuples = [x for x in removed if isinstance(x, tuple)]
+        added_tuples = [y for y in added if isinstance(y, tuple)]
+        limit = self.options.set_pairing_limit
+        if limit is None or len(added_tuples) <= limit:
+            ranking = [
+                (self._obj_similarity(x, y), x, y)
+                for x in removed_tuples
+                for y in added_tuples
+            ]
+        else:
+            ranking = []
+            # Candidates are the added tuples sharing the most values at the same positions, then
+            # those closest in length. Values shared by too many tuples are not worth indexing.
+            postings = {}
+            by_length = {}
+            for y in added_tuples:
+                by_length.setdefault(len(y), []).append(y)
+                for entry in enumerate(y):
+                    postings.setdefault(entry, []).append(y)
+            max_posting = max(64, 8 * limit)
+            lengths = sorted(by_length)
+            for k, x in enumerate(removed_tuples):
+                hits = {}
+                for entry in enumerate(x):
+                    posting = postings.get(entry, ())
+                    if len(posting) <= max_posting:
+                        for y in posting:
+                            hits[y] = hits.get(y, 0) + 1
+                candidates = sorted(hits, key=hits.get, reverse=True)[:limit]
+                hi = bisect.bisect_left(lengths, len(x))
+                lo = hi - 1
+                while len(candidates) < limit and (lo >= 0 or hi < len(lengths)):
+                    if hi < len(lengths) and (lo < 0 or lengths[hi] - len(x) <= len(x) - lengths[lo]):
+                        bucket = by_length[lengths[hi]]
+                        hi += 1
+                    else:
+                        bucket = by_length[lengths[lo]]
+                        lo -= 1
+                    # Successive elements start at different offsets so they do not all compete for the same candidates
+                    start = k * limit
+                    for t in range(len(bucket)):
+                        y = bucket[(start + t) % len(bucket)]
+                        if y not in hits:
+                            candidates.append(y)
+                            if len(candidates) == limit:
+                                break
+                ranking.extend((self._obj_similarity(x, y), x, y) for y in candidates)
+        ranking.sort(reverse=True, key=lambda x: x[0])
+        r2 = set(removed_tuples)
+        a2 = set(added_tuples)
         n_common = len(a) - len(removed)
         s_common = float(n_common)
         for s, x, y in ranking:
@@ -888,13 +2492,176 @@ class JsonDiffer:
             if not r2 or not a2:
                 break
         n_tot = len(a) + len(added)
-        s = s_common / n_tot if n_tot != 0 else 1.0
-        return self.options.syntax.emit_set_diff(a, b, s, added, removed), s
+        return s_common / n_tot if n_tot != 0 else 1.0
 
-    def _dict_diff(self, a, b, exclude_paths, path):
+    def _set_diff(self, a, b):
+        """
+        Computes the difference between two sets.
+        """
+        removed = a.difference(b)
+        added = b.difference(a)
+        if not removed and not added:
+            return {}, 1.0
+        s = self._set_similarity_0(a, removed, added)
+        return self._emit(self.options.syntax.emit_set_diff, a, b, s, added, removed), s
+
+    def _set_similarity(self, a, b):
+        """
+        Computes the similarity score of two sets, as returned by _set_diff.
+        """
+        removed = a.difference(b)
+        added = b.difference(a)
+        if not removed and not added:
+            return 1.0
+        return self._set_similarity_0(a, removed, added)
+
+    def _similarity_bound(self, a, b, depth=2):
+        """
+        Upper bound of the similarity score of two objects, as returned by _obj_similarity, computed without
+        aligning lists or pairing set elements. For dicts it is the Jaccard index of their keys, refined by
+        the bounds of the values of common keys down to the given depth. For lists it is the ratio of their
+        lengths, and for sets the score they would get if every removed element were paired with an added
+        one of the same value.
+        """
+        if a is b:
+            return 1.0
+        if isinstance(a, dict) and isinstance(b, dict):
+            if len(b) < len(a):
+                a, b = b, a
+            nmatched = 0
+            smatched = 0.0
+            for k, v in a.items():
+                w = b.get(k, missing)
+                if w is not missing:
+                    nmatched += 1
+                    smatched += 1.0 if depth <= 1 else 0.5 + 0.5 * self._similarity_bound(v, w, depth - 1)
+            n_tot = len(a) + len(b) - nmatched
+            return smatched / n_tot if n_tot != 0 else 1.0
+        elif (isinstance(a, tuple) and isinstance(b, tuple)) or (isinstance(a, list) and isinstance(b, list)):
+            m, n = len(a), len(b)
+            return min(m, n) / max(m, n) if m or n else 1.0
+        elif isinstance(a, set) and isinstance(b, set):
+            nremoved = len(a.difference(b))
+            nadded = len(b) - (len(a) - nremoved)
+            n_tot = len(a) + nadded
+            return (len(a) - nremoved + min(nremoved, nadded)) / n_tot if n_tot != 0 else 1.0
+        elif a != b:
+            return 0.0
+        else:
+            return 1.0
+
+    def _start_budgets(self):
         """
-        Computes the difference between two dictionaries.
+        Sets the budget state for a diff or a similarity, when the differ has budgets.
         """
+        options = self.options
+        if options.max_similarity_depth is None and options.max_lcs_cells is None and options.timeout is None:
+            return
+        self._path = ()
+        if options.timeout is not None:
+            self._deadline = time.monotonic() + options.timeout
+            self._depth = options.max_similarity_depth if options.max_similarity_depth is not None else float('inf')
+        else:
+            self._depth = options.max_similarity_depth
+
+    def _stop_budgets(self):
+        self._path = None
+        self._deadline = None
+        self._depth = None
+
+    def _degrade(self, a, b, path):
+        """
+        Emits a and b as replaced when diffing them exceeds a budget, and reports their path unless they are
+        equal.
+
+        :param path: The keys and indices leading to a and b, or None.
+        """
+        s = 1.0 if self._equal(a, b) else 0.0
+        if s == 0.0 and path is not None:
+            self.degraded_paths.append(tuple(path))
+        return self._emit(self.options.syntax.emit_value_diff, a, b, s), s
+
+    def _path_state(self, exclude_paths):
+        """
+        :return: The state of the root compiled from exclude_paths and the list_keys option, see
+            _exclude_child, or None when there are neither.
+        """
+        if exclude_paths:
+            return (_PathTrie.compile(exclude_paths, self.options.list_keys),)
+        return self._list_keys
+
+    def _exclude_child(self, exclude, key):
+        """
+        Matches the key of a dict or the index of a list against the exclude_paths state of its parent.
+
+        :param exclude: Tuple of the _PathTrie nodes matching the parent, or None when no excluded path
+            goes through it.
+        :return: The state of the child in the same form, where a first node marked as excluded means the
+            child itself is excluded.
+        """
+        segment = key if isinstance(key, str) else str(key)
+        if '.' in segment:
+            return self._exclude_dotted_child(exclude, segment)
+        nodes = []
+        for node in exclude:
+            for child in (node.children.get(segment), node.children.get('*')):
+                if child is not None:
+                    if child.excluded:
+                        return (child,)
+                    nodes.append(child)
+        return tuple(nodes) if nodes else None
+
+    def _exclude_dotted_child(self, exclude, segment):
+        """
+        Matches a dict key containing dots like _exclude_child, as the segments of the path it joins into,
+        so that excluding "a.b" excludes the key "a.b" as well as the key "b" of the value of the key "a".
+        """
+        parts = segment.split('.')
+        for i, part in enumerate(parts):
+            nodes = []
+            for node in exclude:
+                for child in (node.children.get(part), node.children.get('*')):
+                    if child is not None:
+                        if child.excluded and i == len(parts) - 1:
+                            return (child,)
+                        nodes.append(child)
+            if not nodes:
+                return None
+            exclude = nodes
+        return tuple(exclude)
+
+    def _sharded_diffs(self, pool, pairs):
+        """
+        Diffs (a, b, exclude) triples in contiguous shards across a process pool. Values nested past
+        _max_pickled_nesting levels cannot be pickled to the processes, and are left to the caller.
+
+        :return: The (diff, similarity) of each triple in order, or None for those left to the caller.
+        """
+        deep = [_nested_deeper(a, _max_pickled_nesting) or _nested_deeper(b, _max_pickled_nesting)
+                for a, b, _ in pairs]
+        sent = [pair for pair, nested in zip(pairs, deep) if not nested]
+        size = -(-len(sent) // (4 * self.options.workers)) or 1
+        shards = [sent[i:i+size] for i in range(0, len(sent), size)]
+        results = iter([r for shard in pool.map(_diff_shard, [self] * len(shards), shards) for r in shard])
+        return [None if nested else next(results) for nested in deep]
+
+    def _dict_diff(self, a, b, exclude, path, pool=None):
+        """
+        Frame computing the difference between two dictionaries, see _diff_step.
+
+        :param path: The keys and indices leading to a and b while diffing with budgets, or None.
+        :param pool: Optional process pool diffing the values of the keys in both dictionaries.
+        """
+        diffs = None
+        if pool is not None:
+            keys = []
+            pairs = []
+            for k, v in a.items():
+                child = None if exclude is None else self._exclude_child(exclude, k)
+                if k in b and (child is None or not child[0].excluded):
+                    keys.append(k)
+                    pairs.append((v, b[k], child))
+            diffs = {k: r for k, r in zip(keys, self._sharded_diffs(pool, pairs)) if r is not None}
         removed = {}
         nremoved = 0
         nadded = 0
@@ -902,93 +2669,658 @@ class JsonDiffer:
         smatched = 0.0
         added = {}
         changed = {}
+        child = None
         for k, v in a.items():
-            new_path = f'{path}.{k}' if path else k
-            if new_path in exclude_paths:
-                continue
+            if exclude is not None:
+                child = self._exclude_child(exclude, k)
+                if child is not None and child[0].excluded:
+                    continue
             w = b.get(k, missing)
             if w is missing:
                 nremoved += 1
                 removed[k] = v
             else:
                 nmatched += 1
-                d, s = self._obj_diff(v, w, exclude_paths, new_path)
+                if v is w:
+                    # Left as it was, as most values are, so there is no diff to emit
+                    smatched += 1.0
+                    continue
+                if diffs is not None and k in diffs:
+                    d, s = diffs[k]
+                else:
+                    r = self._diff_step(v, w, child, None if path is None else path + (k,))
+                    if type(r) is GeneratorType:
+                        yield r
+                        r = self._result
+                    d, s = r
                 if s < 1.0:
                     changed[k] = d
                 smatched += 0.5 + 0.5 * s
         for k, v in b.items():
             if k not in a:
-                new_path = f'{path}.{k}' if path else k
-                if new_path in exclude_paths:
-                    continue
+                if exclude is not None:
+                    child = self._exclude_child(exclude, k)
+                    if child is not None and child[0].excluded:
+                        continue
                 nadded += 1
                 added[k] = v
         n_tot = nremoved + nmatched + nadded
         s = smatched / n_tot if n_tot != 0 else 1.0
-        return self.options.syntax.emit_dict_diff(a, b, s, added, changed, removed), s
+        if s == 1.0 and (changed or added or removed):
+            s = _almost_one
+        self._result = self._emit(self.options.syntax.emit_dict_diff, a, b, s, added, changed, removed,
+                                  children=changed), s
 
-    def _obj_diff(self, a, b, exclude_paths=None, path=''):
+    def _dict_similarity(self, a, b, exclude, depth):
+        """
+        Frame computing the similarity score of two dictionaries, as returned by _dict_diff, see _diff_step.
+
+        With the similarity_sample option, the score of large dictionaries is estimated from a sample of the
+        keys of either. It is the mean of what each key of either dictionary adds up to it, so keys of a and
+        keys only in b are drawn at the same rate, which makes them a sample of all the keys.
+
+        :param depth: The levels left to score the values of the dictionaries, or None.
+        """
+        sample = self.options.similarity_sample
+        sampled = sample is not None and (len(a) > sample or len(b) > sample)
+        if sampled:
+            keys_a, keys_b = self._sampled_keys(a, b, sample)
+        else:
+            keys_a, keys_b = a, b
+        n_tot = 0
+        nmatched = 0
+        smatched = 0.0
+        differs = False
+        child = None
+        for k in keys_a:
+            if exclude is not None:
+                child = self._exclude_child(exclude, k)
+                if child is not None and child[0].excluded:
+                    continue
+            n_tot += 1
+            w = b.get(k, missing)
+            if w is not missing:
+                nmatched += 1
+                s = self._similarity_step(a[k], w, child, depth)
+                if type(s) is GeneratorType:
+                    yield s
+                    s = self._result
+                if s < 1.0:
+                    differs = True
+                smatched += 0.5 + 0.5 * s
+        if exclude is None and keys_b is b:
+            n_tot += len(b) - nmatched
+        else:
+            for k in keys_b:
+                if k not in a:
+                    if exclude is not None:
+                        child = self._exclude_child(exclude, k)
+                        if child is not None and child[0].excluded:
+                            continue
+                    n_tot += 1
+        s = smatched / n_tot if n_tot != 0 else 1.0
+        # Keys left out of the sample may differ, and a score of 1.0 would have the dictionaries taken as equal
+        if s == 1.0 and (differs or nmatched < n_tot or (sampled and not self._equal(a, b))):
+            s = _almost_one
+        self._result = s
+
+    def _sampled_keys(self, a, b, sample):
+        """
+        Draws the keys of a and of b that _dict_similarity scores with the similarity_sample option.
+        """
+        from random import Random
+
+        rng = Random(len(a) * 1000003 + len(b))
+        rate = sample / max(len(a), len(b))
+        return rng.sample(list(a), round(rate * len(a))), rng.sample(list(b), round(rate * len(b)))
+
+    def _emit(self, emit, *args, children=None):
+        """
+        Calls an emit method of the syntax. When diffing with the marshal or dump option, the emitted node is
+        marshaled right away, so that the finished diff is not walked and copied again. The child diffs it
+        embeds were marshaled when they were emitted themselves, and are kept as they are.
+
+        :param children: Dict of the child diffs passed to the syntax, which it may add raw values to.
+        """
+        if not self._marshaling:
+            return emit(*args)
+        done = {id(d) for d in children.values()} if children else ()
+        d = emit(*args)
+        # The empty nodes of unchanged values, which are most of them, have nothing to marshal
+        if type(d) in _plain_types or (type(d) is dict and not d):
+            return d
+        return self._marshal_emitted(d, done)
+
+    def _marshal_emitted(self, d, done):
+        """
+        Marshals an emitted diff node like marshal, except for the child diffs whose ids are in done.
+        """
+        return _map_tree(d, self._escape, done)
+
+    def _obj_diff(self, a, b, exclude=None, pool=None):
         """
         Computes the difference between any two JSON-compatible objects.
+
+        :param exclude: The exclude_paths state of a and b, see _exclude_child.
+        :param pool: Optional process pool diffing the children of a and b.
         """
-        if not exclude_paths:
-            exclude_paths = []
-        if path in exclude_paths:
+        r = self._diff_step(a, b, exclude, self._path, pool)
+        return self._run_deep(r) if type(r) is GeneratorType else r
+
+    def _obj_similarity(self, a, b, exclude=None):
+        """
+        Computes the similarity score of any two JSON-compatible objects, as returned by _obj_diff,
+        without building the diff itself.
+        """
+        s = self._similarity_step(a, b, exclude, self._depth)
+        return self._run_deep(s) if type(s) is GeneratorType else s
+
+    def _diff_step(self, a, b, exclude, path, pool=None):
+        """
+        Diffs two values. Dicts and lists are diffed by a frame, a generator which leaves its result in
+        self._result as it finishes rather than returning it, so that it is iterated rather than sent values.
+        The frame is run right away by recursion, unless nested past _max_frames, in which case it is returned
+        for the caller to run on an explicit stack with _run_deep. A frame diffs the values it holds with
+        _diff_step likewise, and yields the frames returned to it, reading their results from self._result
+        once resumed.
+
+        :param path: The keys and indices leading to a and b while diffing with budgets, or None.
+        :return: The (diff, similarity) of a and b, or their frame when nested past _max_frames.
+        """
+        if exclude is not None and exclude[0].excluded:
             return {}, 1.0
-        if a is b:
-            return self.options.syntax.emit_value_diff(a, b, 1.0), 1.0
+        if a is b or (self._hashes is not None and self._equal_subtrees(a, b)):
+            return self._emit(self.options.syntax.emit_value_diff, a, b, 1.0), 1.0
+        if (self._deadline is not None and isinstance(a, _containers) and isinstance(b, _containers)
+                and time.monotonic() > self._deadline):
+            return self._degrade(a, b, path)
         if isinstance(a, dict) and isinstance(b, dict):
-            return self._dict_diff(a, b, exclude_paths, path)
-        elif isinstance(a, tuple) and isinstance(b, tuple):
-            return self._list_diff(a, b)
-        elif isinstance(a, list) and isinstance(b, list):
-            return self._list_diff(a, b)
+            frame, frames = self._dict_diff(a, b, exclude, path, pool), 3
+        elif (isinstance(a, tuple) and isinstance(b, tuple)) or (isinstance(a, list) and isinstance(b, list)):
+            frame, frames = self._list_diff(a, b, exclude, path, pool), 8
         elif isinstance(a, set) and isinstance(b, set):
             return self._set_diff(a, b)
         elif a != b:
-            return self.options.syntax.emit_value_diff(a, b, 0.0), 0.0
+            return self._emit(self.options.syntax.emit_value_diff, a, b, 0.0), 0.0
         else:
-            return self.options.syntax.emit_value_diff(a, b, 1.0), 1.0
+            return self._emit(self.options.syntax.emit_value_diff, a, b, 1.0), 1.0
+        if self._frames >= _max_frames:
+            return frame
+        # Run inline rather than by a helper, as this is the hottest path of the diff
+        self._frames += frames
+        try:
+            for child in frame:
+                self._run_deep(child)
+        finally:
+            self._frames -= frames
+        return self._result
+
+    def _similarity_step(self, a, b, exclude, depth):
+        """
+        Scores two values, by a frame when they are dicts or lists, as _diff_step diffs them.
+
+        :param depth: The levels left to score a and b with the max_similarity_depth or timeout budget, or None.
+        :return: The similarity score of a and b, or their frame when nested past _max_frames.
+        """
+        if exclude is not None and exclude[0].excluded:
+            return 1.0
+        if a is b or (self._hashes is not None and self._equal_subtrees(a, b)):
+            return 1.0
+        if depth is not None:
+            if depth == 0 or (self._deadline is not None and time.monotonic() > self._deadline):
+                return 1.0 if self._equal(a, b) else 0.0
+        if isinstance(a, dict) and isinstance(b, dict):
+            frame, frames = self._dict_similarity, 3
+        elif (isinstance(a, tuple) and isinstance(b, tuple)) or (isinstance(a, list) and isinstance(b, list)):
+            frame, frames = self._list_similarity, 8
+        elif isinstance(a, set) and isinstance(b, set):
+            frame, frames = None, 2
+        elif a != b:
+            return 0.0
+        else:
+            return 1.0
+        if self._pending is not None:
+            return self._scored(a, b, exclude)
+        if depth is not None:
+            depth -= 1
+        if frame is not None:
+            frame = frame(a, b, exclude, depth)
+            if self._frames >= _max_frames:
+                return frame
+            self._frames += frames
+            try:
+                for child in frame:
+                    self._run_deep(child)
+            finally:
+                self._frames -= frames
+            return self._result
+        # Tuples in sets are scored by _obj_similarity with the levels left
+        saved = self._depth
+        self._depth = depth
+        self._frames += frames
+        try:
+            return self._set_similarity(a, b)
+        finally:
+            self._depth = saved
+            self._frames -= frames
+
+    def _run_deep(self, frame):
+        """
+        Runs a frame of values nested past _max_frames on an explicit stack rather than by recursion, so that
+        the depth of the structures is bounded by memory rather than by the recursion limit, and returns its
+        result. From then on until the end of the diff, the scores of the elements of aligned lists are kept,
+        so that nested values are scored once rather than once for every level above them.
+        """
+        if self._scores is None:
+            self._scores = {}
+        stack = [frame]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+            else:
+                stack.append(child)
+        return self._result
 
-    def diff(self, a, b, fp=None, exclude_paths: list = None) -> dict:
+    def _stream_diff(self, ra, rb, ea, eb, path, exclude):
         """
-        Computes the difference between two JSON structures.
-        :param a: The original JSON structure.
-        :param b: The modified JSON structure.
-        :param fp: Optional file pointer to dump the diff to.
-        :param exclude_paths: Optional list of string paths to exclude from the diff.
+        Diffs the values starting with the events ea and eb of the _JsonEvents readers ra and rb.
+
+        :return: Generator of (path, diff) fragments.
         """
-        if not exclude_paths:
-            exclude_paths = []
-        if self.options.load:
-            a = self.options.loader(a)
-            b = self.options.loader(b)
+        syntax = type(self.options.syntax)
+        if exclude is not None and exclude[0].excluded:
+            ra.read_value(ea)
+            rb.read_value(eb)
+        elif ea[0] == 'start_map' and eb[0] == 'start_map' and syntax.emit_dict_diff in _edit_emitters:
+            yield from self._stream_dict_diff(ra, rb, path, exclude)
+        elif ea[0] == 'start_array' and eb[0] == 'start_array' and syntax.emit_list_diff in _edit_emitters:
+            yield from self._stream_list_diff(ra, rb, path, exclude)
+        else:
+            yield from self._stream_value_diff(ra.read_value(ea), rb.read_value(eb), path, exclude)
 
-        d, s = self._obj_diff(a, b, exclude_paths)
+    def _stream_value_diff(self, a, b, path, exclude):
+        """
+        Diffs two values read whole while streaming.
+        """
+        if exclude is None or not exclude[0].excluded:
+            try:
+                d, s = self._obj_diff(a, b, exclude)
+            finally:
+                # Deeply nested values enable caches holding on to their containers, see _run_deep
+                self._hashes = None
+                self._scores = None
+                self._result = None
+            if s < 1.0:
+                yield path, d
 
-        if self.options.marshal or self.options.dump:
-            d = self.marshal(d)
+    def _stream_dict_diff(self, ra, rb, path, exclude):
+        """
+        Diffs two objects while streaming. Keys met in the same order are diffed as they are read, other
+        keys are held back until their counterpart is read or the objects end.
+        """
+        removed = {}
+        added = {}
+        ea, eb = ra.next(), rb.next()
+        while ea[0] == 'map_key' or eb[0] == 'map_key':
+            if ea[0] == 'map_key' and eb[0] == 'map_key' and ea[1] == eb[1]:
+                k = ea[1]
+                child = None if exclude is None else self._exclude_child(exclude, k)
+                yield from self._stream_diff(ra, rb, ra.next(), rb.next(), path + (k,), child)
+                ea, eb = ra.next(), rb.next()
+                continue
+            if ea[0] == 'map_key':
+                k, v = ea[1], ra.read_value(ra.next())
+                if k in added:
+                    child = None if exclude is None else self._exclude_child(exclude, k)
+                    yield from self._stream_value_diff(v, added.pop(k), path + (k,), child)
+                else:
+                    removed[k] = v
+                ea = ra.next()
+            if eb[0] == 'map_key':
+                k, v = eb[1], rb.read_value(rb.next())
+                if k in removed:
+                    child = None if exclude is None else self._exclude_child(exclude, k)
+                    yield from self._stream_value_diff(removed.pop(k), v, path + (k,), child)
+                else:
+                    added[k] = v
+                eb = rb.next()
+        if exclude is not None:
+            for pending in (removed, added):
+                for k in list(pending):
+                    child = self._exclude_child(exclude, k)
+                    if child is not None and child[0].excluded:
+                        del pending[k]
+        if removed or added:
+            # The objects only partially differ, so neither a replacement nor an empty diff is emitted, and the
+            # emitter does not use the objects themselves, see _edit_emitters
+            yield path, self.options.syntax.emit_dict_diff(None, None, 0.5, added, {}, removed)
+
+    def _stream_list_diff(self, ra, rb, path, exclude):
+        """
+        Diffs two arrays while streaming, by position. Only the trailing elements of the longer array
+        are held in memory.
+        """
+        i = 0
+        ea, eb = ra.next(), rb.next()
+        while ea[0] != 'end_array' and eb[0] != 'end_array':
+            child = None if exclude is None else self._exclude_child(exclude, i)
+            yield from self._stream_diff(ra, rb, ea, eb, path + (i,), child)
+            i += 1
+            ea, eb = ra.next(), rb.next()
+        deleted = []
+        while ea[0] != 'end_array':
+            deleted.append((i + len(deleted), ra.read_value(ea)))
+            ea = ra.next()
+        deleted.reverse()
+        inserted = []
+        while eb[0] != 'end_array':
+            inserted.append((i + len(inserted), rb.read_value(eb)))
+            eb = rb.next()
+        if deleted or inserted:
+            # As for objects, see _stream_dict_diff
+            yield path, self.options.syntax.emit_list_diff(None, None, 0.5, inserted, {}, deleted)
+
+    def _deferred_dict_diff(self, a, b, exclude=None):
+        """
+        Emits the diff node of two dictionaries like _dict_diff, with a _DeferredDiff in place of the diff of
+        each changed value. Values are compared rather than diffed, so the similarity score passed to the
+        syntax is exact when it is 0.0 or 1.0, and otherwise the lowest score the changed values allow.
+
+        :return: The node and the dict of changed values passed to the syntax.
+        """
+        removed = {}
+        added = {}
+        changed = {}
+        nmatched = 0
+        child = None
+        for k, v in a.items():
+            if exclude is not None:
+                child = self._exclude_child(exclude, k)
+                if child is not None and child[0].excluded:
+                    continue
+            w = b.get(k, missing)
+            if w is missing:
+                removed[k] = v
+            else:
+                nmatched += 1
+                if child is None:
+                    unchanged = v is w or v == w
+                else:
+                    unchanged = self._obj_similarity(v, w, child) == 1.0
+                if not unchanged:
+                    changed[k] = _DeferredDiff(v, w, child)
+        for k, v in b.items():
+            if k not in a:
+                if exclude is not None:
+                    child = self._exclude_child(exclude, k)
+                    if child is not None and child[0].excluded:
+                        continue
+                added[k] = v
+        n_tot = len(removed) + nmatched + len(added)
+        s = (nmatched - 0.5 * len(changed)) / n_tot if n_tot != 0 else 1.0
+        if s == 1.0 and (changed or added or removed):
+            s = _almost_one
+        return self.options.syntax.emit_dict_diff(a, b, s, added, changed, removed), changed
+
+    def _deferred_list_diff(self, X, Y, exclude=None):
+        """
+        Emits the diff node of two lists like _list_diff, with a _DeferredDiff in place of the diff of each
+        changed element.
+
+        :return: The node and the dict of changed elements passed to the syntax.
+        """
+        inserted = []
+        deleted = []
+        changed = {}
+        tot_s = 0.0
+        rows = None
+        if exclude is not None:
+            rows = [self._exclude_child(exclude, i) for i in range(len(X))]
+        for sign, i, j, s in self._list_align(X, Y, exclude, rows):
+            if sign == 1:
+                inserted.append((j, Y[j]))
+            elif sign == -1:
+                deleted.insert(0, (i, X[i]))
+            elif sign == 0 and s < 1:
+                changed[j] = _DeferredDiff(X[i], Y[j], rows[i] if rows else None)
+            tot_s += s
+        tot_n = len(X) + len(inserted)
+        s = tot_s / tot_n if tot_n != 0 else 1.0
+        if s == 1.0 and (changed or inserted or deleted):
+            s = _almost_one
+        return self.options.syntax.emit_list_diff(X, Y, s, inserted, changed, deleted), changed
+
+    def _diff_encoder(self, fp):
+        """
+        :return: The json.JSONEncoder of the dumper when the diff can be written to fp as it is computed, that
+            is with a stdlib JsonDumper, a builtin syntax, no worker processes and no budgets, or None.
+        """
+        options = self.options
+        dumper = options.dumper
+        if (fp is None or not isinstance(dumper, JsonDumper) or dumper.backend != "json" or "cls" in dumper.kwargs
+                or type(options.syntax) not in _deferrable_syntaxes
+                or (options.workers and options.workers > 1)
+                or (options.max_similarity_depth, options.max_lcs_cells, options.timeout) != (None, None, None)):
+            return None
+        return json.JSONEncoder(**dumper.kwargs)
+
+    def diff(self, a, b, fp=None, exclude_paths: list = None) -> dict:
+        """
+        Computes the difference between two JSON structures.
+        :param a: The original JSON structure, or a DocumentIndex of it.
+        :param b: The modified JSON structure, or a DocumentIndex of it.
+        :param fp: Optional file pointer to dump the diff to. With a stdlib JsonDumper and a builtin syntax, the
+            diff is written to it as it is computed rather than built in memory first.
+        :param exclude_paths: Optional list of dot-separated paths to exclude from the diff. Segments are dict
+            keys or list indices, and `*` matches any of them, as in 'items.*.updated_at'. Paths are matched
+            against the keys joined with dots, so 'a.b' also excludes the key 'a.b'.
+        """
+        exclude = self._path_state(exclude_paths)
+        if self.options.load:
+            a = self._load(a)
+            b = self._load(b)
+        return self._diff_loaded(a, b, fp, exclude)
+
+    def _diff_loaded(self, a, b, fp, exclude):
+        """
+        Computes the difference between two loaded JSON structures, with compiled exclude_paths.
+        """
+        self._hashes = {} if self.options.hashing else None
+        a = self._indexed(a)
+        b = self._indexed(b)
+        pool = None
+        if self.options.workers and self.options.workers > 1 and (
+                (isinstance(a, dict) and isinstance(b, dict)) or (isinstance(a, list) and isinstance(b, list))
+                or (isinstance(a, tuple) and isinstance(b, tuple))):
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(self.options.workers)
+        encoder = self._diff_encoder(fp) if self.options.dump else None
+        self._marshaling = self.options.marshal or self.options.dump
+        self.degraded_paths = []
+        self._start_budgets()
+        try:
+            if encoder is not None:
+                # The diff is written as it is computed instead of being built and dumped
+                return _DiffWriter(self, encoder, fp.write).diff(a, b, exclude)
+            d, s = self._obj_diff(a, b, exclude, pool)
+        finally:
+            self._hashes = None
+            self._scores = None
+            self._result = None
+            self._marshaling = False
+            self._stop_budgets()
+            if pool is not None:
+                pool.shutdown()
 
         if self.options.dump:
             return self.options.dumper(d, fp)
         else:
             return d
 
+    def diff_many(self, pairs, exclude_paths: list = None, workers=None, chunk_size=64, cache_size=16):
+        """
+        Computes the differences between many pairs of JSON structures with the same differ.
+
+        With the load option, the structures loaded from the most recently seen strings are cached, so that
+        a base document appearing in many pairs is only parsed once. The diffs may then share objects with
+        each other, as a diff shares objects with the structures it was computed from.
+
+        :param pairs: Iterable of (a, b) pairs, which may be a generator. It is consumed lazily. Structures may be
+            given as DocumentIndex objects, as in diff.
+        :param exclude_paths: Optional list of paths to exclude from each diff, as in diff.
+        :param workers: Optional number of processes diffing chunks of pairs in parallel. The differ, the pairs
+            and their diffs are pickled to and from them, so that they must be nested less deep than the
+            recursion limit allows, unlike when diffing serially.
+        :param chunk_size: Number of pairs sent to a process at once.
+        :param cache_size: Number of loaded structures cached by source string.
+        :return: Iterator of the diffs, in the order of the pairs.
+        :raise ValueError: chunk_size is less than 1 or cache_size is negative.
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+        if cache_size < 0:
+            raise ValueError(f"cache_size must not be negative, not {cache_size}")
+        # Compiled here so that invalid paths are reported before any pair is read or process started
+        exclude = self._path_state(exclude_paths)
+        if workers and workers > 1:
+            return self._diff_many_parallel(pairs, exclude_paths, workers, chunk_size, cache_size)
+        return self._diff_many(pairs, exclude, cache_size)
+
+    def _diff_many(self, pairs, exclude, cache_size):
+        cache = OrderedDict()
+
+        def load(src):
+            if not isinstance(src, (str, bytes)):
+                return self._load(src)
+            o = cache.get(src, missing)
+            if o is missing:
+                o = cache[src] = self.options.loader(src)
+                if len(cache) > cache_size:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(src)
+            return o
+
+        for a, b in pairs:
+            if self.options.load:
+                a = load(a)
+                b = load(b)
+            yield self._diff_loaded(a, b, None, exclude)
+
+    def _diff_many_parallel(self, pairs, exclude_paths, workers, chunk_size, cache_size):
+        from concurrent.futures import ProcessPoolExecutor
+        from itertools import islice
+
+        pairs = iter(pairs)
+        pending = []
+        exhausted = False
+        with ProcessPoolExecutor(workers) as pool:
+            while True:
+                # Keep a bounded number of chunks in flight, so that a generator of pairs is read lazily
+                while not exhausted and len(pending) < 2 * workers:
+                    chunk = list(islice(pairs, chunk_size))
+                    if chunk:
+                        pending.append(pool.submit(_diff_many_chunk, self, chunk, exclude_paths, cache_size))
+                    else:
+                        exhausted = True
+                if not pending:
+                    break
+                yield from pending.pop(0).result()
+
+    def diff_stream(self, fp_a, fp_b, exclude_paths: list = None):
+        """
+        Computes the difference between two JSON documents parsed incrementally, for documents too large
+        to load. Objects are aligned by key and arrays by position, and only the keys which are out of
+        order between two objects and the trailing elements of the longer of two arrays are held in memory
+        besides the current nesting. Syntaxes whose diffs of objects or arrays embed the values themselves,
+        as the rightonly syntax does for arrays, are passed them whole, read into memory.
+
+        :param fp_a: File-like object, in text or binary mode, holding the original JSON document.
+        :param fp_b: File-like object holding the modified JSON document.
+        :param exclude_paths: Optional list of paths to exclude from the diff, as in diff.
+        :return: Generator of (path, diff) fragments, where path is the tuple of keys and indices leading to
+            a value in the original document and diff is the diff of that value in the differ's syntax.
+            Patching each value with its fragment in order yields the modified document.
+        """
+        exclude = self._path_state(exclude_paths)
+        ra = _JsonEvents(fp_a)
+        rb = _JsonEvents(fp_b)
+        for path, d in self._stream_diff(ra, rb, ra.next(), rb.next(), (), exclude):
+            if self.options.marshal:
+                d = self.marshal(d)
+            yield path, d
+        ra.end()
+        rb.end()
+
     def similarity(self, a, b):
         """
-        Calculates the similarity score between two JSON structures.
+        Calculates the similarity score between two JSON structures, either of which may be a DocumentIndex.
         """
         if self.options.load:
-            a = self.options.loader(a)
-            b = self.options.loader(b)
+            a = self._load(a)
+            b = self._load(b)
 
-        d, s = self._obj_diff(a, b)
+        self._hashes = {} if self.options.hashing else None
+        self._start_budgets()
+        try:
+            return self._obj_similarity(self._indexed(a), self._indexed(b), self._list_keys)
+        finally:
+            self._hashes = None
+            self._scores = None
+            self._result = None
+            self._stop_budgets()
 
-        return s
+    def most_similar(self, query, candidates, k=5):
+        """
+        Finds the candidates most similar to a JSON structure, as scored by similarity. Candidates are scored
+        in decreasing order of a cheap upper bound of their similarity, based on the keys, lengths and types
+        of their top levels, until no remaining candidate can make it to the top k.
 
-    def patch(self, a, d, fp=None):
+        :param query: The JSON structure to look up, or a DocumentIndex.
+        :param candidates: Iterable of JSON structures or DocumentIndex objects.
+        :param k: Number of candidates to return.
+        :return: List of up to k (index, score) pairs, where index is the position of the candidate in
+            candidates, by decreasing score then increasing index.
+        """
+        if self.options.load:
+            query = self._load(query)
+            candidates = [self._load(c) for c in candidates]
+        else:
+            candidates = list(candidates)
+        if k <= 0:
+            return []
+
+        def document(o):
+            return o.document if isinstance(o, DocumentIndex) else o
+
+        bounds = (self._similarity_bound(document(query), document(c)) for c in candidates)
+        order = sorted((-bound, i) for i, bound in enumerate(bounds))
+        # The best candidates so far as (score, -index), the worst of them first
+        top = []
+        self._hashes = {} if self.options.hashing else None
+        try:
+            query = self._indexed(query)
+            for bound, i in order:
+                if len(top) == k and (-bound, -i) < top[0]:
+                    break
+                s = self._obj_similarity(query, self._indexed(candidates[i]), self._list_keys)
+                if len(top) < k:
+                    heapq.heappush(top, (s, -i))
+                elif (s, -i) > top[0]:
+                    heapq.heapreplace(top, (s, -i))
+        finally:
+            self._hashes = None
+            self._scores = None
+            self._result = None
+        return [(-i, s) for s, i in sorted(top, reverse=True)]
+
+    def patch(self, a, d, fp=None, inplace=False):
         """
         Applies a diff to a JSON structure to produce the modified structure.
+
+        :param inplace: Whether to mutate the dicts, lists and sets of a instead of copying every container
+            along the patched paths. Tuples are immutable and still rebuilt.
         """
         if self.options.load:
             a = self.options.loader(a)
@@ -997,16 +3329,21 @@ class JsonDiffer:
         if self.options.marshal or self.options.load:
             d = self.unmarshal(d)
 
-        b = self.options.syntax.patch(a, d)
+        if inplace:
+            b = self.options.syntax.patch(a, d, inplace=True)
+        else:
+            b = self.options.syntax.patch(a, d)
 
         if self.options.dump:
             return self.options.dumper(b, fp)
         else:
             return b
 
-    def unpatch(self, b, d, fp=None):
+    def unpatch(self, b, d, fp=None, inplace=False):
         """
         Reverses a diff on a JSON structure to produce the original structure.
+
+        :param inplace: Whether to mutate the dicts, lists and sets of b instead of copying them.
         """
         if self.options.load:
             b = self.options.loader(b)
@@ -1015,13 +3352,43 @@ class JsonDiffer:
         if self.options.marshal or self.options.load:
             d = self.unmarshal(d)
 
-        a = self.options.syntax.unpatch(b, d)
+        if inplace:
+            a = self.options.syntax.unpatch(b, d, inplace=True)
+        else:
+            a = self.options.syntax.unpatch(b, d)
 
         if self.options.dump:
             return self.options.dumper(a, fp)
         else:
             return a
 
+    def compose(self, d1, d2, fp=None):
+        """
+        Composes two consecutive diffs into one diff, patching like d1 then d2, without the document they
+        apply to. A chain of diffs can be squashed with functools.reduce.
+
+        :param d1: The first diff.
+        :param d2: The diff applied after d1.
+        :param fp: Optional file pointer to dump the composed diff to.
+        """
+        if self.options.load:
+            d1 = self.options.loader(d1)
+            d2 = self.options.loader(d2)
+
+        if self.options.marshal or self.options.load:
+            d1 = self.unmarshal(d1)
+            d2 = self.unmarshal(d2)
+
+        d = self.options.syntax.compose(d1, d2)
+
+        if self.options.marshal or self.options.dump:
+            d = self.marshal(d)
+
+        if self.options.dump:
+            return self.options.dumper(d, fp)
+        else:
+            return d
+
     def _unescape(self, x):
         """
         Unescapes a string that has been escaped.
@@ -1038,18 +3405,7 @@ class JsonDiffer:
         """
         Converts a marshaled (potentially escaped) structure back to its original form.
         """
-        if isinstance(d, dict):
-            return {
-                self._unescape(k): self.unmarshal(v)
-                for k, v in d.items()
-            }
-        elif isinstance(d, (list, tuple)):
-            return type(d)(
-                self.unmarshal(x)
-                for x in d
-            )
-        else:
-            return self._unescape(d)
+        return _map_tree(d, self._unescape)
 
     def _escape(self, o):
         """
@@ -1065,18 +3421,7 @@ class JsonDiffer:
         """
         Converts a structure to a marshaled (potentially escaped) form.
         """
-        if isinstance(d, dict):
-            return {
-                self._escape(k): self.marshal(v)
-                for k, v in d.items()
-            }
-        elif isinstance(d, (list, tuple)):
-            return type(d)(
-                self.marshal(x)
-                for x in d
-            )
-        else:
-            return self._escape(d)
+        return _map_tree(d, self._escape)
 
 
 def diff(a, b, fp=None, cls=JsonDiffer, **kwargs):
@@ -1093,6 +3438,21 @@ def diff(a, b, fp=None, cls=JsonDiffer, **kwargs):
     return cls(**kwargs).diff(a, b, fp)
 
 
+def diff_stream(fp_a, fp_b, cls=JsonDiffer, exclude_paths=None, **kwargs):
+    """
+    Computes the difference between two JSON documents parsed incrementally from file-like objects using a
+    specified JsonDiffer class.
+
+    :param fp_a: File-like object holding the original JSON document.
+    :param fp_b: File-like object holding the modified JSON document.
+    :param cls: The JsonDiffer class or subclass to use for computing the diff.
+    :param exclude_paths: Optional list of paths to exclude from the diff.
+    :param kwargs: Additional keyword arguments to pass to the JsonDiffer constructor.
+    :return: Generator of (path, diff) fragments.
+    """
+    return cls(**kwargs).diff_stream(fp_a, fp_b, exclude_paths)
+
+
 def patch(a, d, fp=None, cls=JsonDiffer, **kwargs):
     """
     Applies a diff to a JSON structure to produce the modified structure using a specified JsonDiffer class.
@@ -1107,6 +3467,51 @@ def patch(a, d, fp=None, cls=JsonDiffer, **kwargs):
     return cls(**kwargs).patch(a, d, fp)
 
 
+def diff_many(pairs, cls=JsonDiffer, exclude_paths=None, workers=None, chunk_size=64, cache_size=16, **kwargs):
+    """
+    Computes the differences between many pairs of JSON structures using a single instance of a specified
+    JsonDiffer class.
+
+    :param pairs: Iterable of (a, b) pairs.
+    :param cls: The JsonDiffer class or subclass to use for computing the diffs.
+    :param exclude_paths: Optional list of paths to exclude from each diff.
+    :param workers: Optional number of processes diffing the pairs in parallel.
+    :param chunk_size: Number of pairs sent to a process at once.
+    :param cache_size: Number of loaded structures cached by source string.
+    :param kwargs: Additional keyword arguments to pass to the JsonDiffer constructor.
+    :return: Iterator of the diffs, in the order of the pairs.
+    """
+    return cls(**kwargs).diff_many(pairs, exclude_paths, workers, chunk_size, cache_size)
+
+
+def compose(d1, d2, fp=None, cls=JsonDiffer, **kwargs):
+    """
+    Composes two consecutive diffs into one using a specified JsonDiffer class.
+
+    :param d1: The first diff.
+    :param d2: The diff applied after d1.
+    :param fp: Optional file pointer to dump the composed diff to.
+    :param cls: The JsonDiffer class or subclass to use for composing the diffs.
+    :param kwargs: Additional keyword arguments to pass to the JsonDiffer constructor.
+    :return: The composed diff.
+    """
+    return cls(**kwargs).compose(d1, d2, fp)
+
+
+def most_similar(query, candidates, k=5, cls=JsonDiffer, **kwargs):
+    """
+    Finds the candidates most similar to a JSON structure using a specified JsonDiffer class.
+
+    :param query: The JSON structure to look up.
+    :param candidates: Iterable of JSON structures.
+    :param k: Number of candidates to return.
+    :param cls: The JsonDiffer class or subclass to use for calculating similarity.
+    :param kwargs: Additional keyword arguments to pass to the JsonDiffer constructor.
+    :return: List of up to k (index, score) pairs, by decreasing score.
+    """
+    return cls(**kwargs).most_similar(query, candidates, k)
+
+
 def similarity(a, b, cls=JsonDiffer, **kwargs):
     """
     Calculates the similarity score between two JSON structures using a specified JsonDiffer class.
@@ -1122,8 +3527,13 @@ def similarity(a, b, cls=JsonDiffer, **kwargs):
 
 __all__ = [
     "similarity",
+    "most_similar",
     "diff",
+    "diff_stream",
+    "diff_many",
+    "compose",
     "JsonDiffer",
+    "DocumentIndex",
     "JsonDumper",
     "JsonLoader",
     "YamlDumper",
@@ -1,9 +1,12 @@
 import argparse
+import itertools
+import json
 import jsondiff
 import sys
 
 def load_file(serializer, file_path):
-    with open(file_path) as f:
+    # Files are read as bytes, which json backends and yaml parse without decoding them first
+    with open(file_path, "rb") as f:
         parsed = None
         try:
             parsed = serializer.deserialize_file(f)
@@ -13,47 +16,121 @@ def load_file(serializer, file_path):
             print(f"{file_path} does not exist")
     return parsed
 
+def stream_diff(args):
+    try:
+        with open(args.first, "rb") as first, open(args.second[0], "rb") as second:
+            for path, x in jsondiff.diff_stream(first, second, marshal=True, syntax=args.syntax):
+                json.dump([list(path), x], sys.stdout)
+                sys.stdout.write("\n")
+    except ValueError:
+        print(f"{args.first} or {args.second[0]} is not valid json")
+        return 1
+    except FileNotFoundError as e:
+        print(f"{e.filename} does not exist")
+        return 1
+    return 0
+
+def documents_diff(args, serializer):
+    differ = jsondiff.JsonDiffer(marshal=True, syntax=args.syntax)
+    missing = object()
+    try:
+        with open(args.first, "rb") as first, open(args.second[0], "rb") as second:
+            pairs = itertools.zip_longest(serializer.deserialize_documents(first),
+                                          serializer.deserialize_documents(second), fillvalue=missing)
+            for i, (a, b) in enumerate(pairs):
+                # A missing document is null, and a missing patch leaves its document unchanged
+                a = None if a is missing else a
+                if args.patch:
+                    x = differ.patch(a, {} if b is missing else b)
+                else:
+                    x = differ.diff(a, None if b is missing else b)
+                if i:
+                    sys.stdout.write("---\n")
+                serializer.serialize_data(x, sys.stdout)
+    except ValueError:
+        print(f"{args.first} or {args.second[0]} is not valid {serializer.file_format}")
+        return 1
+    except FileNotFoundError as e:
+        print(f"{e.filename} does not exist")
+        return 1
+    return 0
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument("first")
-    parser.add_argument("second")
+    parser.add_argument("second", nargs="+",
+                        help="One or more files, each diffed against or patching the first one")
     parser.add_argument("-p", "--patch", action="store_true", default=False)
     parser.add_argument("-s", "--syntax", choices=(jsondiff.builtin_syntaxes.keys()), default="compact",
                         help="Diff syntax controls how differences are rendered")
     parser.add_argument("-i", "--indent", action="store", type=int, default=None,
-                        help="Number of spaces to indent. None is compact, no indentation.")
+                        help="Number of spaces to indent. None is compact, no indentation. Ignored when "
+                             "writing json lines, with --stream or several second files")
     parser.add_argument("-f", "--format", choices=("json", "yaml"), default="json",
                         help="Specify file format for input and dump")
+    parser.add_argument("--json-backend", choices=["auto", *jsondiff.json_backends], default=None,
+                        help="Library used for json, by default the stdlib json module. auto picks the "
+                             "fastest one installed")
+    parser.add_argument("--documents", action="store_true", default=False,
+                        help="Diff or patch the documents of two multi-document yaml files pairwise, "
+                             "loading one document at a time")
+    parser.add_argument("--stream", action="store_true", default=False,
+                        help="Diff json files incrementally without loading them, printing one "
+                             "[path, diff] fragment per line")
 
     args = parser.parse_args()
 
-    serializer = jsondiff.Serializer(args.format, args.indent)
+    if args.stream:
+        if args.patch or args.format != "json" or len(args.second) > 1:
+            print("--stream only diffs two json files")
+            return 1
+        return stream_diff(args)
+
+    # Several json results are written one per line, which indenting them would break
+    indent = None if len(args.second) > 1 and args.format == "json" else args.indent
+    try:
+        serializer = jsondiff.Serializer(args.format, indent, args.json_backend)
+    except (ImportError, ValueError) as e:
+        print(e)
+        return 1
+
+    if args.documents:
+        if len(args.second) > 1:
+            print("--documents only takes two files")
+            return 1
+        return documents_diff(args, serializer)
 
     parsed_first = load_file(serializer, args.first)
-    parsed_second = load_file(serializer, args.second)
 
-    if not (parsed_first and parsed_second):
+    if not parsed_first:
         return 1
 
+    invalid = []
+
+    def parsed_seconds():
+        for path in args.second:
+            parsed_second = load_file(serializer, path)
+            if not parsed_second:
+                invalid.append(path)
+                return
+            yield parsed_second
+
+    differ = jsondiff.JsonDiffer(marshal=True, syntax=args.syntax)
     if args.patch:
-        x = jsondiff.patch(
-            parsed_first,
-            parsed_second,
-            marshal=True,
-            syntax=args.syntax
-        )
+        results = (differ.patch(parsed_first, parsed_second) for parsed_second in parsed_seconds())
     else:
-        x = jsondiff.diff(
-            parsed_first,
-            parsed_second,
-            marshal=True,
-            syntax=args.syntax
-        )
+        results = differ.diff_many((parsed_first, parsed_second) for parsed_second in parsed_seconds())
 
-    serializer.serialize_data(x, sys.stdout)
+    for i, x in enumerate(results):
+        # Several results are written as json lines or as a stream of yaml documents
+        if i and args.format == "yaml":
+            sys.stdout.write("---\n")
+        serializer.serialize_data(x, sys.stdout)
+        if len(args.second) > 1 and args.format == "json":
+            sys.stdout.write("\n")
 
-    return 0
+    return 1 if invalid else 0
 
 if __name__ == '__main__':
     ret = main()
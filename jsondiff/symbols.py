@@ -43,6 +43,10 @@ class Symbol:
     def __hash__(self) -> int:
         return hash(self.label)
 
+    def __reduce__(self):
+        # Symbols are compared by identity when patching, so unpickle to the module's own instances
+        return _from_label, (self._label,)
+
 
 missing = Symbol('missing')
 identical = Symbol('identical')
@@ -68,6 +72,14 @@ _all_symbols_ = [
     right
 ]
 
+_symbols_by_label = {symbol.label: symbol for symbol in _all_symbols_}
+
+
+def _from_label(label):
+    symbol = _symbols_by_label.get(label)
+    return symbol if symbol is not None else Symbol(label)
+
+
 __all__ = [
     'missing',
     'identical',
@@ -0,0 +1,213 @@
+# benchmarks of JsonDiffer across the builtin syntaxes and data shapes
+#
+#   python -m tests.benchmark [--scale 1.0] [--repeat 3] [--shape wide_dict] [--syntax compact]
+#                             [--list-algorithm myers] [--save results.json] [--compare results.json]
+#
+# Each operation is timed on its own and then run once more under tracemalloc for its peak memory.
+# Similarity does not depend on the syntax, so it is measured once per shape. The import time of
+# jsondiff, as reported by python -X importtime in fresh interpreters, is measured first.
+# With --compare, operations slower than the saved results by more than --tolerance are reported
+# and the exit status is 1.
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import jsondiff
+from jsondiff import JsonDiffer
+
+from .utils import generate_random_json, perturbate_json
+
+
+def perturbate_values(values, rng, **kwargs):
+    # perturbate_json may replace a whole container, so the elements are perturbated one by one
+    return [perturbate_json(v, rng, **kwargs) for v in values if rng.random() < 0.95]
+
+
+def wide_dict(rng, scale):
+    a = {f'key{i}': generate_random_json(rng, sets=True) for i in range(int(20000 * scale))}
+    keys = [k for k in a if rng.random() < 0.95]
+    b = dict(zip(keys, perturbate_values([a[k] for k in keys], rng, sets=True)))
+    b.update((f'new{i}', generate_random_json(rng)) for i in range(int(500 * scale)))
+    return a, b
+
+
+def deep_nesting(rng, scale):
+    def nest(depth):
+        if depth == 0:
+            return generate_random_json(rng)
+        return {'value': generate_random_json(rng, max_depth=2), 'child': nest(depth - 1)}
+
+    def perturbate_nest(o):
+        if rng.random() < 0.01:
+            return generate_random_json(rng)
+        if not (isinstance(o, dict) and 'child' in o):
+            return perturbate_json(o, rng)
+        return {'value': perturbate_json(o['value'], rng, max_depth=2), 'child': perturbate_nest(o['child'])}
+
+    a = [nest(int(300 * scale)) for _ in range(20)]
+    return a, [perturbate_nest(o) for o in a]
+
+
+def long_list(rng, scale):
+    a = [rng.randint(0, 1000) for _ in range(int(2000 * scale))]
+    b = list(a)
+    for _ in range(20):
+        i = rng.randrange(len(b))
+        if rng.random() < 0.5:
+            b[i] = rng.randint(0, 1000)
+        else:
+            b.insert(i, rng.randint(0, 1000))
+    return a, b
+
+
+def long_list_of_objects(rng, scale):
+    a = [generate_random_json(rng, max_depth=3) for _ in range(int(1000 * scale))]
+    b = list(a)
+    for _ in range(10):
+        i = rng.randrange(len(b))
+        b[i] = perturbate_json(b[i], rng, max_depth=3)
+    return a, b
+
+
+def big_set(rng, scale):
+    a = {generate_random_json(rng, hashable=True) for _ in range(int(3000 * scale))}
+    return a, set(perturbate_values(a, rng, hashable=True))
+
+
+def random_mix(rng, scale):
+    a = {f'key{i}': [generate_random_json(rng, sets=True) for _ in range(20)] for i in range(int(200 * scale))}
+    return a, {k: perturbate_values(v, rng, sets=True) for k, v in a.items()}
+
+
+shapes = {
+    'wide_dict': wide_dict,
+    'deep_nesting': deep_nesting,
+    'long_list': long_list,
+    'long_list_of_objects': long_list_of_objects,
+    'big_set': big_set,
+    'random_mix': random_mix,
+}
+
+
+def operations(a, b, **options):
+    """
+    Yields (name, function) for each operation supported by the syntax of a differ with the given options.
+    """
+    differ = JsonDiffer(**options)
+    marshaling = JsonDiffer(marshal=True, **options)
+    syntax = differ.options.syntax
+    d = differ.diff(a, b)
+    yield 'diff', lambda: differ.diff(a, b)
+    yield 'diff_marshal', lambda: marshaling.diff(a, b)
+    if hasattr(syntax, 'patch'):
+        yield 'patch', lambda: differ.patch(a, d)
+    if hasattr(syntax, 'unpatch'):
+        yield 'unpatch', lambda: differ.unpatch(b, d)
+    m = differ.marshal(d)
+    yield 'marshal', lambda: differ.marshal(d)
+    yield 'unmarshal', lambda: differ.unmarshal(m)
+
+
+def measure(f, repeat):
+    """
+    :return: Best time in seconds out of repeat runs, and peak memory in bytes.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def measure_import(repeat):
+    """
+    :return: Best import time of jsondiff in seconds out of repeat fresh interpreters.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import jsondiff'],
+                             capture_output=True, text=True, check=True).stderr
+        # import time: self [us] | cumulative [us] | module
+        cumulative = next(int(line.split('|')[1]) for line in out.splitlines()
+                          if line.split('|')[-1].strip() == 'jsondiff')
+        best = min(best, cumulative / 1e6)
+    return best
+
+
+def run(args):
+    results = {}
+    seconds = measure_import(args.repeat)
+    results['import'] = {'seconds': seconds, 'peak_bytes': 0}
+    print(f'{"import":<50} {seconds * 1000:>12.2f} ms', flush=True)
+
+    def record(name, f):
+        seconds, peak = measure(f, args.repeat)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak}
+        print(f'{name:<50} {seconds * 1000:>12.2f} ms {peak / 2 ** 20:>10.2f} MiB', flush=True)
+
+    for shape in args.shape or shapes:
+        a, b = shapes[shape](random.Random(args.seed), args.scale)
+        differ = JsonDiffer(list_algorithm=args.list_algorithm)
+        record(f'{shape}/similarity', lambda: differ.similarity(a, b))
+        for syntax in args.syntax or jsondiff.builtin_syntaxes:
+            for op, f in operations(a, b, syntax=syntax, list_algorithm=args.list_algorithm):
+                record(f'{shape}/{syntax}/{op}', f)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: Names of the operations slower than in the baseline by more than the tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['seconds'] > baseline[name]['seconds'] * (1 + tolerance):
+            print(f'regression: {name} took {result["seconds"]:.4f}s, '
+                  f'against {baseline[name]["seconds"]:.4f}s in the baseline')
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--shape', action='append', choices=shapes.keys(),
+                        help='Data shape to benchmark, may be repeated. All shapes by default.')
+    parser.add_argument('--syntax', action='append', choices=jsondiff.builtin_syntaxes.keys(),
+                        help='Diff syntax to benchmark, may be repeated. All syntaxes by default.')
+    parser.add_argument('--list-algorithm', choices=('lcs', 'myers'), default='lcs',
+                        help='List algorithm of the differs, see JsonDiffer')
+    parser.add_argument('--scale', type=float, default=1.0, help='Factor applied to the size of the data')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, the best one is kept')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data')
+    parser.add_argument('--save', help='File to save the results to, as json')
+    parser.add_argument('--compare', help='File of saved results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown relative to the compared results reported as a regression')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
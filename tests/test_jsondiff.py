@@ -1,12 +1,19 @@
+import copy
 import io
+import itertools
+import json
 import logging
 import os.path
+import pickle
+import random
+import subprocess
 import sys
 import unittest
+import unittest.mock
 import pytest
 
 import jsondiff
-from jsondiff import diff, replace, add, discard, insert, delete, JsonDiffer
+from jsondiff import diff, replace, add, discard, insert, delete, DocumentIndex, JsonDiffer
 
 from .utils import generate_random_json, perturbate_json
 
@@ -34,6 +41,25 @@ def generate_scenario_no_sets(rng):
     return a, b
 
 
+def generate_scenario_records(rng):
+    def records(key, n):
+        return [{key: rng.randint(0, 2 * n), 'value': generate_random_json(rng, max_depth=2)} for _ in range(n)]
+
+    def perturbate_records(rs):
+        rs = [dict(r, value=perturbate_json(r['value'], rng, max_depth=2)) if rng.random() < 0.3 else r
+              for r in rs if rng.random() < 0.9]
+        if rng.random() < 0.2:
+            rng.shuffle(rs)
+        # Records without the key of their list, or which are not records, are inserted
+        return rs + [rng.choice([{'id': rng.randint(0, 10)}, 'x']) for _ in range(rng.randint(0, 2))]
+
+    a = {'records': [dict(r, items=records('sku', rng.randint(0, 5))) for r in records('id', rng.randint(0, 10))]}
+    b = {'records': [dict(r, items=perturbate_records(r['items'])) if isinstance(r, dict) and 'items' in r
+                     and rng.random() < 0.5 else r
+                     for r in perturbate_records(a['records'])]}
+    return a, b
+
+
 class JsonDiffTests(unittest.TestCase):
 
     def test_a(self):
@@ -95,6 +121,19 @@ class JsonDiffTests(unittest.TestCase):
 
         self.assertEqual(d, differ.unmarshal(dm))
 
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_marshal_while_diffing(self, scenario):
+        a, b = scenario
+        a = {'$a': a, '$insert': ['$x', ('$y', 1)], 'c': {'$replace': 1, 'd': '$c', 'e': ['$d', 1]}}
+        b = {'$a': b, '$$delete': '$z', 'c': {'$replace': 2, '$b': ['$', 'c'], 'd': '$e', 'e': ['$f', 1]}}
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax)
+            d = differ.diff(a, b)
+            dm = JsonDiffer(syntax=syntax, marshal=True).diff(a, b)
+            self.assertEqual(differ.marshal(d), dm)
+            self.assertEqual(d, differ.unmarshal(dm))
+
     @given(strategies.randoms().map(generate_scenario_no_sets))
     @settings(max_examples=1000)
     def test_dump(self, scenario):
@@ -135,6 +174,474 @@ class JsonDiffTests(unittest.TestCase):
         dm = differ.marshal(d)
         self.assertEqual(d, differ.unmarshal(dm))
 
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=200)
+    def test_list_cache_eviction(self, scenario):
+        a, b = scenario
+        for syntax in ('compact', 'symmetric'):
+            expected = JsonDiffer(syntax=syntax).diff(a, b)
+            for list_cache_size in (0, 1, 3):
+                differ = JsonDiffer(syntax=syntax, list_cache_size=list_cache_size)
+                self.assertEqual(expected, differ.diff(a, b))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_similarity_matches_diff(self, scenario):
+        a, b = scenario
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax)
+            _, s = differ._obj_diff(a, b)
+            self.assertEqual(s, differ.similarity(a, b))
+
+    def test_common_prefix_and_suffix(self):
+        size = 50000
+        a = [{'a': i} for i in range(size)]
+        b = a[:100] + [{'a': -1}, {'a': 100, 'b': 1}] + a[101:]
+        self.assertEqual({insert: [(100, {'a': -1})], 101: {'b': 1}}, diff(a, b))
+        self.assertEqual({delete: [100]}, diff(a, a[:100] + a[101:]))
+        self.assertEqual({insert: [(size, {'a': 0})]}, diff(a, a + [{'a': 0}]))
+        for syntax in ('compact', 'symmetric'):
+            differ = JsonDiffer(syntax=syntax)
+            d = differ.diff(a, b)
+            self.assertEqual(b, differ.patch(a, d))
+        d = diff(a, b, syntax='symmetric')
+        self.assertEqual(a, JsonDiffer(syntax='symmetric').unpatch(b, d))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_myers_list_algorithm(self, scenario):
+        a, b = scenario
+        for hunk_cells in (0, 10000):
+            differ = JsonDiffer(syntax='compact', list_algorithm='myers', hunk_cells=hunk_cells)
+            self.assertEqual(b, differ.patch(a, differ.diff(a, b)))
+            differ = JsonDiffer(syntax='symmetric', list_algorithm='myers', hunk_cells=hunk_cells)
+            d = differ.diff(a, b)
+            self.assertEqual(b, differ.patch(a, d))
+            self.assertEqual(a, differ.unpatch(b, d))
+
+    def test_myers_long_arrays(self):
+        size = 20000
+        a = [{'a': i} for i in range(size)]
+        b = [{'a': i, 'b': 1} if i % 1000 == 500 else x for i, x in enumerate(a) if i % 2000 != 1]
+        differ = JsonDiffer(list_algorithm='myers')
+        d = differ.diff(a, b)
+        self.assertEqual(10, len(d[delete]))
+        self.assertEqual(b, differ.patch(a, d))
+        self.assertRaises(ValueError, JsonDiffer, list_algorithm='quadratic')
+
+    @given(strategies.randoms().map(generate_scenario_records))
+    @settings(max_examples=500)
+    def test_list_keys(self, scenario):
+        a, b = scenario
+        for syntax in ('compact', 'symmetric'):
+            differ = JsonDiffer(syntax=syntax, list_keys={'records': 'id', 'records.*.items': 'sku'})
+            d, s = differ._obj_diff(a, b, differ._list_keys)
+            self.assertEqual(s, differ.similarity(a, b))
+            self.assertEqual(b, differ.patch(a, differ.diff(a, b)))
+            if syntax == 'symmetric':
+                self.assertEqual(a, differ.unpatch(b, d))
+
+    def test_list_keys_alignment(self):
+        a = {'users': [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]}
+        b = {'users': [{'id': 3, 'name': 'c'}, {'id': 1, 'name': 'a'}, {'id': 2, 'name': 'x'}, 'y']}
+        differ = JsonDiffer(list_keys={'users': 'id'})
+        # The records with ids 1 and 2 stay matched, so the one with id 3 moves by deletion and insertion
+        self.assertEqual({'users': {insert: [(0, {'id': 3, 'name': 'c'}), (3, 'y')], 2: {'name': 'x'},
+                                    delete: [2]}}, differ.diff(a, b))
+        self.assertEqual({'users': {insert: [(0, {'id': 3, 'name': 'c'}), (3, 'y')], delete: [2]}},
+                         differ.diff(a, b, exclude_paths=['users.*.name']))
+        self.assertEqual({1: {'n': 2}}, JsonDiffer(list_keys={'': 'id'}).diff(
+            [{'id': 'a', 'n': 1}, {'id': 'b', 'n': 1}], [{'id': 'a', 'n': 1}, {'id': 'b', 'n': 2}]))
+
+    def test_list_keys_long_arrays(self):
+        size = 100000
+        a = {'orders': [{'sku': i, 'quantity': 1} for i in range(size)]}
+        b = {'orders': [{'sku': i, 'quantity': 2} if i % 10000 == 5000 else x
+                        for i, x in enumerate(a['orders']) if i % 20000 != 1]}
+        differ = JsonDiffer(list_keys={'orders': 'sku'})
+        d = differ.diff(a, b)
+        self.assertEqual(5, len(d['orders'][delete]))
+        self.assertEqual(b, differ.patch(a, d))
+        b['orders'].reverse()
+        d = differ.diff(a, b)
+        self.assertEqual(b, differ.patch(a, d))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_budgets(self, scenario):
+        a, b = scenario
+        for budgets in ({'max_lcs_cells': 4}, {'max_similarity_depth': 1}, {'timeout': 0}):
+            differ = JsonDiffer(syntax='symmetric', **budgets)
+            d = differ.diff(a, b)
+            self.assertEqual(b, differ.patch(a, d))
+            self.assertEqual(a, differ.unpatch(b, d))
+            for path in differ.degraded_paths:
+                v = a
+                for k in path:
+                    v = v[k]
+                self.assertIsInstance(v, (dict, list, tuple, set))
+
+    def test_budgets_degraded_paths(self):
+        a = {'users': [{'id': i, 'tags': list(range(i % 7))} for i in range(300)], 'n': [1, 2]}
+        b = {'users': [{'id': i, 'tags': list(range(i % 5))} for i in range(299, -1, -1)], 'n': [2]}
+        differ = JsonDiffer(max_lcs_cells=1000)
+        self.assertEqual({'users': b['users'], 'n': {delete: [0]}}, differ.diff(a, b))
+        self.assertEqual([('users',)], differ.degraded_paths)
+        self.assertEqual({}, differ.diff(a, a))
+        self.assertEqual([], differ.degraded_paths)
+        self.assertEqual(0.5, differ.similarity({'users': a['users']}, {'users': b['users']}))
+
+        # A clock ticking a second per reading runs out of the timeout once inside the document
+        clock = itertools.count()
+        differ = JsonDiffer(timeout=2)
+        with unittest.mock.patch('time.monotonic', lambda: next(clock)):
+            d = differ.diff(a, b)
+        self.assertEqual({'users': b['users'], 'n': b['n']}, d)
+        self.assertEqual(b, differ.patch(a, d))
+        self.assertEqual([('users',), ('n',)], differ.degraded_paths)
+        self.assertRaises(ValueError, JsonDiffer, timeout=1, workers=2)
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_hashing(self, scenario):
+        a, b = scenario
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax, hashing=True)
+            self.assertEqual(JsonDiffer(syntax=syntax).diff(a, b), differ.diff(a, b))
+            self.assertEqual(JsonDiffer(syntax=syntax).similarity(a, b), differ.similarity(a, b))
+        differ = JsonDiffer(syntax='symmetric', list_algorithm='myers', hashing=True)
+        d = differ.diff(a, b)
+        self.assertEqual(b, differ.patch(a, d))
+        self.assertEqual(a, differ.unpatch(b, d))
+
+    def test_hashing_collisions(self):
+        # hash(-1) == hash(-2), so matches found by hash must be checked against the values
+        differ = JsonDiffer(list_algorithm='myers', hunk_cells=0, hashing=True)
+        a = [0, [-1], 1, [-1], 2]
+        b = [3, [-2], 4, [-1], 5]
+        self.assertEqual(b, differ.patch(a, differ.diff(a, b)))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=300)
+    def test_document_index(self, scenario):
+        a, b = scenario
+        ia = DocumentIndex(a)
+        ib = pickle.loads(pickle.dumps(DocumentIndex(b)))
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax)
+            self.assertEqual(differ.diff(a, b), differ.diff(ia, ib))
+            self.assertEqual(differ.similarity(a, b), differ.similarity(ia, b))
+        differ = JsonDiffer(list_algorithm='myers', hunk_cells=0)
+        self.assertEqual(differ.diff(a, b), differ.diff(a, ib))
+
+    def test_document_index_reuse(self):
+        docs = [{'id': i, 'tags': [{'n': i * j} for j in range(20)]} for i in range(10)]
+        query = json.loads(json.dumps(docs[3]))
+        query['tags'][5]['n'] = -1
+        differ = JsonDiffer(load=True)
+        index = [DocumentIndex(doc) for doc in docs]
+        self.assertEqual(differ.most_similar(json.dumps(query), map(json.dumps, docs), k=2),
+                         differ.most_similar(DocumentIndex(query), index, k=2))
+        self.assertEqual({'tags': {5: {'n': 15}}}, differ.diff(json.dumps(query), index[3]))
+        self.assertEqual(docs[3], pickle.loads(pickle.dumps(index[3])).document)
+
+    def test_document_index_hash_collisions(self):
+        # () and [], '' and False, and -1 and -2 have equal hashes but must not be aligned as equal
+        a = [(), '', -1, 'x']
+        b = ['x', [], False, -2]
+        differ = JsonDiffer(list_algorithm='myers', hunk_cells=0)
+        self.assertEqual(differ.diff(a, b), differ.diff(a, DocumentIndex(b)))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_set_pairing_limit(self, scenario):
+        a, b = scenario
+        for syntax in ('compact', 'symmetric'):
+            differ = JsonDiffer(syntax=syntax, set_pairing_limit=1)
+            self.assertEqual(b, differ.patch(a, differ.diff(a, b)))
+            self.assertTrue(0.0 <= differ.similarity(a, b) <= 1.0)
+            if isinstance(a, set) and isinstance(b, set):
+                self.assertEqual(JsonDiffer(syntax=syntax).diff(a, b), differ.diff(a, b))
+
+    def test_large_sets(self):
+        a = {(i, i % 7, 'x') for i in range(20000)}
+        b = {(i, i % 7, 'y') for i in range(20000)}
+        differ = JsonDiffer(set_pairing_limit=3)
+        d = differ.diff(a, b)
+        self.assertEqual(b, differ.patch(a, d))
+        self.assertEqual(0.25, differ.similarity(a, b))
+        a = {(i, i % 7, 'x') for i in range(200)}
+        b = {(i, i % 7, 'y') for i in range(200)}
+        self.assertEqual(JsonDiffer().similarity(a, b), differ.similarity(a, b))
+
+    def test_similarity_sample(self):
+        rng = random.Random(0)
+        a = {f'key{i}': generate_random_json(rng, max_depth=2) for i in range(5000)}
+        b = {k: perturbate_json(v, rng, max_depth=2) for k, v in a.items() if rng.random() < 0.9}
+        b.update((f'new{i}', i) for i in range(250))
+        differ = JsonDiffer(similarity_sample=1000)
+        s = differ.similarity(a, b)
+        self.assertAlmostEqual(JsonDiffer().similarity(a, b), s, delta=0.043)
+        self.assertEqual(s, differ.similarity(a, b))
+        self.assertEqual(1.0, differ.similarity(a, dict(a)))
+
+        X = [a, {'id': 1}, b]
+        Y = [{'id': 2}, b, a]
+        d = differ.diff(X, Y)
+        self.assertEqual(Y, differ.patch(X, d))
+
+        # A change outside the sampled keys is still diffed rather than lost
+        x = {str(i): i for i in range(20)}
+        y = dict(x, **{'7': -1})
+        X, Y = ['x', x], ['y', y]
+        differ = JsonDiffer(similarity_sample=2)
+        self.assertLess(differ.similarity(x, y), 1.0)
+        d = differ.diff(X, Y)
+        self.assertEqual({1: {'7': -1}, insert: [(0, 'y')], delete: [0]}, d)
+        self.assertEqual(Y, differ.patch(X, d))
+
+    @given(strategies.randoms().map(generate_scenario_no_sets))
+    @settings(max_examples=200)
+    def test_diff_stream(self, scenario):
+        a, b = json.loads(json.dumps(scenario[0])), json.loads(json.dumps(scenario[1]))
+
+        class Trickle(io.StringIO):
+            def read(self, n=-1):
+                return super().read(min(n, 7))
+
+        for syntax in ('compact', 'symmetric', 'rightonly'):
+            differ = JsonDiffer(syntax=syntax)
+            r = json.loads(json.dumps(a))
+            for path, d in differ.diff_stream(Trickle(json.dumps(a)), io.BytesIO(json.dumps(b).encode())):
+                if not path:
+                    r = differ.patch(r, d)
+                    continue
+                parent = r
+                for k in path[:-1]:
+                    parent = parent[k]
+                parent[path[-1]] = differ.patch(parent[path[-1]], d)
+            self.assertEqual(b, r)
+
+    def test_diff_stream_syntaxes(self):
+        a = '{"x": [1, 2], "y": {"p": 1, "q": 2}}'
+        b = '{"x": [1], "y": {"p": 1, "r": 3}}'
+        expected = {
+            'compact': [(('x',), {delete: [1]}), (('y',), {'r': 3, delete: ['q']})],
+            'explicit': [(('x',), {delete: [1]}), (('y',), {insert: {'r': 3}, delete: ['q']})],
+            'symmetric': [(('x',), {delete: [(1, 2)]}), (('y',), {insert: {'r': 3}, delete: {'q': 2}})],
+            # Arrays are diffed whole, as the syntax emits the modified array
+            'rightonly': [(('x',), [1]), (('y',), {'r': 3, delete: ['q']})],
+        }
+        self.assertEqual(set(jsondiff.builtin_syntaxes), set(expected))
+        for syntax, fragments in expected.items():
+            self.assertEqual(fragments, list(jsondiff.diff_stream(io.StringIO(a), io.StringIO(b), syntax=syntax)))
+
+    def test_diff_stream_invalid(self):
+        # Documents json.loads rejects, each diffed against a valid one
+        for doc in ('[1 2]', '[1,,2]', '[1,]', '{"a" 1}', '{"a": 1,}', '{1: 2}', '{"a": [1] "b": 2}', '[1}',
+                    '[1] 2', '[1'):
+            with self.assertRaises(json.JSONDecodeError):
+                list(jsondiff.diff_stream(io.StringIO(doc), io.StringIO('[1, 3]')))
+            with self.assertRaises(json.JSONDecodeError):
+                list(jsondiff.diff_stream(io.StringIO('{"a": 1, "b": [2]}'), io.StringIO(doc)))
+
+    def test_diff_stream_exclude_paths(self):
+        a = {'items': [{'id': 1, 'ts': 1}, {'id': 2, 'ts': 2}], 'n': 1, 'm': 1}
+        b = {'items': [{'id': 1, 'ts': 3}, {'id': 3, 'ts': 4}, 5], 'm': 2}
+        fragments = list(jsondiff.diff_stream(io.StringIO(json.dumps(a)), io.StringIO(json.dumps(b)),
+                                              exclude_paths=['items.*.ts', 'n']))
+        self.assertEqual([(('items', 1, 'id'), 3), (('items',), {insert: [(2, 5)]}), (('m',), 2)], fragments)
+
+    def test_workers(self):
+        rng = random.Random(42)
+        scenarios = [generate_scenario(rng) for _ in range(20)]
+        a = {str(i): scenario[0] for i, scenario in enumerate(scenarios)}
+        b = {str(i): scenario[1] for i, scenario in enumerate(scenarios)}
+        b['new'] = 1
+        for syntax in jsondiff.builtin_syntaxes:
+            serial = JsonDiffer(syntax=syntax)
+            parallel = JsonDiffer(syntax=syntax, workers=2)
+            self.assertEqual(serial.diff(a, b), parallel.diff(a, b))
+            self.assertEqual(serial.diff(list(a.values()), list(b.values())),
+                             parallel.diff(list(a.values()), list(b.values())))
+            self.assertEqual(serial.diff(a, b, exclude_paths=['1', '2.*']),
+                             parallel.diff(a, b, exclude_paths=['1', '2.*']))
+        d = JsonDiffer(workers=2).diff(a, b)
+        self.assertEqual(b, JsonDiffer().patch(a, d))
+
+    def test_workers_deep_nesting(self):
+        def nest(leaf):
+            o = leaf
+            for i in range(3000):
+                o = {'k': o, 'n': i} if i % 2 else [i, o]
+            return o
+
+        # Values too deep to be pickled are diffed in the calling process
+        a = {'x': [nest(1)] * 3, 'y': [1, 2], 'z': nest(3)}
+        b = {'x': [nest(2)] * 3, 'y': [1, 3], 'z': nest(4)}
+        d = JsonDiffer(workers=2).diff(a, b)
+        self.assertTrue(jsondiff._deep_equal(JsonDiffer().diff(a, b), d))
+        self.assertTrue(jsondiff._deep_equal(b, JsonDiffer().patch(a, d)))
+        a = list(a.values())
+        b = list(b.values())
+        self.assertTrue(jsondiff._deep_equal(JsonDiffer().diff(a, b), JsonDiffer(workers=2).diff(a, b)))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_inplace_patch(self, scenario):
+        a, b = scenario
+        for syntax in ('compact', 'symmetric'):
+            differ = JsonDiffer(syntax=syntax)
+            d = differ.diff(a, b)
+            self.assertEqual(b, differ.patch(copy.deepcopy(a), d, inplace=True))
+        differ = JsonDiffer(syntax='symmetric')
+        self.assertEqual(a, differ.unpatch(copy.deepcopy(b), differ.diff(a, b), inplace=True))
+
+    def test_inplace_patch_mutates(self):
+        a = {'x': [1, 2, {'y': 1}], 's': {1, 2}, 't': (1, 2), 'z': 0}
+        b = {'x': [1, 3, {'y': 2}, 4], 's': {1, 3}, 't': (1, 3), 'z': 0}
+        for syntax in ('compact', 'symmetric'):
+            differ = JsonDiffer(syntax=syntax)
+            d = differ.diff(a, b)
+            target = copy.deepcopy(a)
+            x, y, s = target['x'], target['x'][2], target['s']
+            self.assertIs(target, differ.patch(target, d, inplace=True))
+            self.assertEqual(b, target)
+            self.assertIs(x, target['x'])
+            self.assertIs(y, target['x'][2])
+            self.assertIs(s, target['s'])
+
+    def test_list_patch_edits(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            a = [rng.randint(0, 9) for _ in range(rng.randint(0, 12))]
+            deletes = sorted(rng.sample(range(len(a)), rng.randint(0, len(a))), reverse=True)
+            n = len(a) - len(deletes) + rng.randint(0, 4)
+            inserts = [(pos, -pos) for pos in sorted(rng.sample(range(n), n - len(a) + len(deletes)))]
+            if rng.random() < 0.2:
+                rng.shuffle(deletes)
+                rng.shuffle(inserts)
+            expected = list(a)
+            try:
+                for pos in deletes:
+                    expected.pop(pos)
+            except IndexError:
+                self.assertRaises(IndexError, jsondiff._edit_list, a, deletes, inserts)
+                continue
+            for pos, value in inserts:
+                expected.insert(pos, value)
+            self.assertEqual(expected, jsondiff._edit_list(tuple(a), deletes, inserts))
+            self.assertEqual(expected, JsonDiffer().patch(a, {delete: deletes, insert: inserts}))
+        a = list(range(100000))
+        d = {delete: list(range(99990, 0, -10)), insert: [(i, -i) for i in range(0, 100000, 10)]}
+        self.assertEqual(a, JsonDiffer(syntax='symmetric').unpatch(
+            JsonDiffer().patch(a, d), {delete: [(i, i) for i in d[delete]], insert: d[insert]}))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_compose_symmetric(self, scenario):
+        a, b = scenario
+        differ = JsonDiffer(syntax='symmetric')
+        c = perturbate_json(b, random.Random(repr(scenario)), sets=True)
+        d = jsondiff.compose(differ.diff(a, b), differ.diff(b, c), syntax='symmetric')
+        self.assertEqual(c, differ.patch(a, d))
+        self.assertEqual(a, differ.unpatch(c, d))
+
+    def test_compose_compact(self):
+        differ = JsonDiffer()
+        chains = [
+            ([0, 1, 2, 3, 4, 5], [9, 0, 2, 4, 5, 8], [0, 2, 7, 4, 8]),
+            ({'a': [1, {'x': 1}, 3], 'b': {1, 2}}, {'a': [{'x': 2}, 3], 'b': {2, 3}}, {'a': [{'x': 2, 'y': 1}, 4], 'b': {1}}),
+            ({'a': 1, 'b': 2}, {'b': 3, 'c': {'x': 1}}, {'a': {'y': 1}, 'b': 4, 'c': {'x': 1, 'z': 2}}),
+            ({'a': {'x': 1}}, {'a': [1, 2]}, {'a': [2, 3]}),
+            ([1, 2], {'x': 1}, {'x': 2}),
+            ({'a': (1, 2, 3)}, {'a': (1, 3)}, {'a': (0, 1, 3, 4)}),
+            ({'x': 1}, {'x': 1, 'k': 2}, {'x': 1}),
+            ({'k': {'y': 1}}, {'k': {'y': 2}}, {}),
+            ({'p': 1, 'q': 2, 'r': 3}, {'p': 1, 'q': 2, 'r': 3, 'k': 1}, {'p': 1, 'q': 2, 'r': 3, 'k': {'x': 1}}),
+            ({'a': 1, 'b': 2, 'c': 3, 'd': 4}, {'b': 5, 'c': 3, 'd': 4}, {'c': 3, 'd': 4}),
+            ({'x': 1}, {'x': 1, 'k': {'y': 1, 'z': 2}}, {'x': 1, 'k': {'y': {'w': 3}}}),
+        ]
+        for a, b, c in chains:
+            d = jsondiff.compose(differ.diff(a, b), differ.diff(b, c))
+            self.assertEqual(c, differ.patch(a, d))
+        d1, d2 = differ.diff(['a', 'b'], ['b', 'c']), differ.diff(['b', 'c'], ['c', 'd'])
+        dm = JsonDiffer(marshal=True).compose(differ.marshal(d1), differ.marshal(d2))
+        self.assertEqual(['c', 'd'], JsonDiffer(marshal=True).patch(['a', 'b'], dm))
+        # A key set then deleted may have been added or changed, so it is set before it is deleted
+        d = jsondiff.compose(differ.diff({'x': 1}, {'x': 1, 'k': 2}), differ.diff({'x': 1, 'k': 2}, {'x': 1}))
+        self.assertEqual({'k': 2, delete: ['k']}, d)
+        # A dict replacing a value which may have been added is not patched into the document
+        d = jsondiff.compose({'k': 1}, {'k': {replace: {'x': 1}}})
+        self.assertEqual({'x': 1}, differ.patch({}, d)['k'])
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=500)
+    def test_compose_compact_applies(self, scenario):
+        a, b = scenario
+        differ = JsonDiffer()
+        c = perturbate_json(b, random.Random(repr(scenario)), sets=True)
+        d = jsondiff.compose(differ.diff(a, b), differ.diff(b, c))
+        self.assertEqual(c, differ.patch(a, d))
+
+    def test_diff_many(self):
+        rng = random.Random(7)
+        pairs = [generate_scenario_no_sets(rng) for _ in range(50)]
+        differ = JsonDiffer(syntax='symmetric')
+        expected = [differ.diff(a, b) for a, b in pairs]
+        self.assertEqual(expected, list(differ.diff_many(iter(pairs))))
+        self.assertEqual(expected, list(differ.diff_many(pairs, workers=2, chunk_size=7)))
+        self.assertEqual(expected, list(jsondiff.diff_many(pairs, syntax='symmetric', workers=2, chunk_size=7)))
+        self.assertRaises(ValueError, jsondiff.diff_many, pairs, workers=2, chunk_size=0)
+
+        loads = []
+
+        def loader(src):
+            loads.append(src)
+            return json.loads(src)
+
+        base = json.dumps({'a': 1, 'b': [1, 2]})
+        differ = JsonDiffer(load=True, loader=loader)
+        diffs = differ.diff_many((base, json.dumps({'a': i, 'b': [1, 2]})) for i in range(100))
+        self.assertEqual({'a': 0}, next(diffs))
+        self.assertEqual(2, len(loads))
+        self.assertEqual([{'a': i} for i in range(2, 100)], list(diffs)[1:])
+        self.assertEqual(1, loads.count(base))
+
+        loads.clear()
+        diffs = jsondiff.diff_many([(base, base)] * 3, load=True, loader=loader, cache_size=0)
+        self.assertEqual([{}] * 3, list(diffs))
+        self.assertEqual(6, len(loads))
+
+    @given(strategies.randoms().map(lambda rng: (rng, generate_random_json(rng, sets=True))))
+    @settings(max_examples=200)
+    def test_most_similar(self, scenario):
+        rng, query = scenario
+        candidates = [perturbate_json(query, rng, sets=True) if rng.random() < 0.5
+                      else generate_random_json(rng, sets=True) for _ in range(20)]
+        differ = JsonDiffer()
+        scores = [(i, differ.similarity(query, c)) for i, c in enumerate(candidates)]
+        expected = sorted(scores, key=lambda x: (-x[1], x[0]))
+        for k in (0, 1, 5, 30):
+            self.assertEqual(expected[:k], differ.most_similar(query, candidates, k))
+
+    def test_most_similar_pruning(self):
+        query = {f'k{i}': i for i in range(10)}
+        candidates = [{f'k{i}': i for i in range(j)} for j in range(1, 11)] + [[1, 2, 3], 'k0']
+        differ = JsonDiffer()
+        scored = []
+        similarity = differ._obj_similarity
+
+        def counting_similarity(a, b, *args):
+            if a is query:
+                scored.append(b)
+            return similarity(a, b, *args)
+
+        differ._obj_similarity = counting_similarity
+        self.assertEqual([(9, 1.0), (8, 0.9)], differ.most_similar(query, candidates, k=2))
+        self.assertEqual([candidates[9], candidates[8]], scored)
+        self.assertEqual([(9, 1.0)], jsondiff.most_similar(query, candidates, k=1))
+
     def test_long_arrays(self):
         size = 100
         a = [{'a': i, 'b': 2 * i} for i in range(1, size)]
@@ -149,6 +656,59 @@ class JsonDiffTests(unittest.TestCase):
         finally:
             sys.setrecursionlimit(r)
 
+    def test_deep_change(self):
+        # Each level scores 0.75 + 0.25 * s, which rounds to 1.0 some thirty levels above a change
+        a = b = None
+        for i in range(100):
+            a = {'k': a or 1, 'n': i}
+            b = {'k': b or 2, 'n': i}
+        self.assertLess(jsondiff.similarity(a, b), 1.0)
+        for syntax in ('compact', 'symmetric'):
+            differ = JsonDiffer(syntax=syntax)
+            self.assertEqual(b, differ.patch(a, differ.diff(a, b)))
+
+    def test_deep_nesting(self):
+        def nest(leaf):
+            o = leaf
+            for i in range(5000):
+                o = {'type': 'node', 'body': [{'n': i}, o]} if i % 2 else [i, o]
+            return o
+
+        # == gives up on structures this deep
+        a = nest({'v': 1})
+        b = nest({'v': 2, 'w': [3]})
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax)
+            d = differ.diff(a, b)
+            self.assertLess(differ.similarity(a, b), 1.0)
+            d = differ.unmarshal(differ.marshal(d))
+            if syntax != 'explicit':
+                self.assertTrue(jsondiff._deep_equal(b, differ.patch(a, d)))
+            if syntax == 'symmetric':
+                self.assertTrue(jsondiff._deep_equal(a, differ.unpatch(b, d)))
+        self.assertEqual(1.0, jsondiff.similarity(a, nest({'v': 1})))
+
+    @given(strategies.randoms().map(generate_scenario))
+    @settings(max_examples=200)
+    def test_explicit_stack(self, scenario):
+        # Values nested past _max_frames are diffed and patched on an explicit stack, here from the top level
+        a, b = scenario
+        differs = [JsonDiffer(syntax=syntax) for syntax in jsondiff.builtin_syntaxes]
+        differs += [JsonDiffer(list_algorithm='myers', hunk_cells=0), JsonDiffer(max_similarity_depth=2),
+                    JsonDiffer(hashing=True), JsonDiffer(max_lcs_cells=20)]
+        expected = [(differ.diff(a, b), differ.similarity(a, b)) for differ in differs]
+        max_frames = jsondiff._max_frames
+        jsondiff._max_frames = 0
+        try:
+            self.assertEqual(expected, [(differ.diff(a, b), differ.similarity(a, b)) for differ in differs])
+            differ = JsonDiffer(syntax='symmetric')
+            d = differ.diff(a, b)
+            self.assertEqual(b, differ.patch(a, d))
+            self.assertEqual(a, differ.unpatch(b, d))
+            self.assertEqual(d, differ.unmarshal(differ.marshal(d)))
+        finally:
+            jsondiff._max_frames = max_frames
+
 
 @pytest.mark.parametrize(
     ("a", "b", "syntax", "expected"),
@@ -232,6 +792,31 @@ class TestLoaders(unittest.TestCase):
             actual = loader(f)
         self.assertEqual(expected, actual)
 
+    def test_json_backends(self):
+        json_file = os.path.join(TestLoaders.data_dir, "test_01.json")
+        expected = {"hello": "world", "data": [1, 2, 3]}
+        for backend in ["auto", *jsondiff.json_backends]:
+            try:
+                loader = jsondiff.JsonLoader(backend)
+                dumper = jsondiff.JsonDumper(backend)
+            except ImportError:
+                continue
+            with open(json_file, "rb") as f:
+                self.assertEqual(expected, loader(f))
+            self.assertEqual(expected, loader(dumper(expected).encode()))
+            self.assertEqual({"1": {"$delete": [0]}}, json.loads(dumper({1: {"$delete": [0]}})))
+        # The auto backend accepts the same documents as the json module
+        self.assertEqual("nan", str(jsondiff.JsonLoader("auto")("[NaN]")[0]))
+        self.assertRaises(ValueError, jsondiff.JsonLoader("auto"), '[1')
+        for loader in (jsondiff.JsonLoader(), jsondiff.JsonLoader("auto")):
+            self.assertEqual([12345678901234567890123], loader('[12345678901234567890123]'))
+            self.assertEqual([-12345678901234567890123], loader(b'[-12345678901234567890123]'))
+        self.assertEqual("json", jsondiff.JsonLoader().backend)
+        self.assertEqual({'a': 12345678901234567890124},
+                         diff('{"a": 12345678901234567890123}', '{"a": 12345678901234567890124}', load=True))
+        self.assertEqual("json", jsondiff.JsonLoader("auto", parse_float=str).backend)
+        self.assertRaises(ValueError, jsondiff.JsonLoader, "yaml")
+
     def test_yaml_string_loader(self):
         json_str = """---
 hello: world
@@ -253,6 +838,21 @@ data:
             actual = loader(f)
         self.assertEqual(expected, actual)
 
+    def test_lazy_imports(self):
+        code = "import sys, jsondiff; print(' '.join(sorted(sys.modules)))"
+        modules = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        for module in ("yaml", "argparse", "jsondiff.cli", *jsondiff.json_backends.keys() - {"json"}):
+            self.assertNotIn(module, modules.stdout.split())
+
+    def test_yaml_documents_loader(self):
+        serializer = jsondiff.Serializer("yaml", None)
+        documents = serializer.deserialize_documents(io.StringIO("a: 1\n---\n- 2\n---\nb: [\n"))
+        self.assertEqual({"a": 1}, next(documents))
+        self.assertEqual([2], next(documents))
+        self.assertRaises(ValueError, next, documents)
+        documents = jsondiff.Serializer("json", None).deserialize_documents(io.BytesIO(b'{"a": 1}'))
+        self.assertEqual([{"a": 1}], list(documents))
+
 
 class TestDumpers(unittest.TestCase):
 
@@ -292,6 +892,34 @@ class TestDumpers(unittest.TestCase):
         dumper(data, buffer)
         self.assertEqual(expected, buffer.getvalue())
 
+    @given(strategies.randoms().map(lambda rng: (rng, *generate_scenario_no_sets(rng))))
+    @settings(max_examples=300)
+    def test_json_dump_diff_fp(self, scenario):
+        rng, a, b = scenario
+        a = {'$a': a, 'b': [a, '$b'], 'c': {'$c': 1}}
+        b = {'$a': b, 'b': ['$c', b], 'c': {'$c': '$d'}, '$$e': ('$f', None)}
+        kwargs = rng.choice([{}, {'indent': 2}, {'indent': '\t', 'ensure_ascii': False}, {'separators': (',', ':')}])
+        exclude_paths = rng.choice([None, ['$a.*'], ['b.1']])
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax, dump=True, dumper=jsondiff.JsonDumper(**kwargs))
+            expected = json.dumps(JsonDiffer(syntax=syntax, marshal=True).diff(a, b, exclude_paths=exclude_paths),
+                                  **kwargs)
+            buffer = io.StringIO()
+            self.assertIsNone(differ.diff(a, b, buffer, exclude_paths=exclude_paths))
+            self.assertEqual(expected, buffer.getvalue())
+
+    def test_json_dump_diff_fp_deep_change(self):
+        # The scores of both lists round to 1.0, yet the lists differ
+        a, b = 1, 2
+        for _ in range(100):
+            a, b = {'k': a}, {'k': b}
+        a, b = [a, 1, 2], [b, 1, 2]
+        for syntax in jsondiff.builtin_syntaxes:
+            differ = JsonDiffer(syntax=syntax, dump=True)
+            buffer = io.StringIO()
+            differ.diff(a, b, buffer)
+            self.assertEqual(json.dumps(JsonDiffer(syntax=syntax, marshal=True).diff(a, b)), buffer.getvalue())
+
     def test_yaml_dump_string(self):
         data = {"hello": "world", "data": [1, 2, 3]}
         expected = """data:
@@ -331,3 +959,24 @@ hello: world
 
         # The diff should only contain changes that are not in the exclude_paths
         self.assertEqual({'b': {'b2': 23}}, d)
+
+    def test_exclude_paths_patterns(self):
+        differ = JsonDiffer()
+
+        a = {'items': [{'id': 1, 'updated_at': 10}, {'id': 2, 'updated_at': 20}], 'tags': ['x', 'y'], 'n': 1}
+        b = {'items': [{'id': 1, 'updated_at': 11}, {'id': 2, 'updated_at': 21}], 'tags': ['x', 'z'], 'n': 2}
+
+        self.assertEqual({}, differ.diff(a, b, exclude_paths=['items.*.updated_at', 'tags.1', 'n']))
+        self.assertEqual({'items': {1: {'updated_at': 21}}},
+                         differ.diff(a, b, exclude_paths=['items.0.updated_at', 'tags', 'n']))
+        self.assertEqual({}, differ.diff(a, b, exclude_paths=['']))
+        self.assertEqual({'n': 2}, differ.diff(a, b, exclude_paths=['*.*']))
+
+    def test_exclude_paths_dotted_keys(self):
+        # Paths match the keys joined with dots, so keys containing dots can be excluded
+        differ = JsonDiffer()
+        self.assertEqual({}, differ.diff({'a.b': 1}, {'a.b': 2}, exclude_paths=['a.b']))
+        a = {'a.b': 1, 'a': {'b': 1, 'c': 1}, 'x.y': {'z': 1, 'w': 1}}
+        b = {'a.b': 2, 'a': {'b': 2, 'c': 2}, 'x.y': {'z': 2, 'w': 2}}
+        self.assertEqual({'a': {'c': 2}, 'x.y': {'w': 2}}, differ.diff(a, b, exclude_paths=['a.b', 'x.y.z']))
+        self.assertEqual({'a.b': 2, 'x.y': {'z': 2, 'w': 2}}, differ.diff(a, b, exclude_paths=['a']))